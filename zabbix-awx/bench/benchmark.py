@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Benchmark de extraer_zabbix.py (y opcionalmente procesar_reporte.py) contra
+el mock local de Zabbix.
+
+Por cada tamaño de flota levanta bench/mock_zabbix.py y corre el extractor
+en cada modo de motor, midiendo tiempo de pared, POSTs y llamadas atendidos
+por el mock, RSS pico del proceso y bytes transferidos. Con --referencia se
+compara contra un resultado guardado (--resultado) y se sale con código 1
+si alguna medida empeora más que --tolerancia.
+
+    python3 bench/benchmark.py --hosts 10,100,1000 --dias 7 --resultado base.json
+    python3 bench/benchmark.py --hosts 10,100,1000 --dias 7 --referencia base.json
+"""
+
+import argparse
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+DIR_BENCH = os.path.dirname(os.path.abspath(__file__))
+DIR_FILES = os.path.join(DIR_BENCH, "..", "roles", "zabbix_report", "files")
+MOCK = os.path.join(DIR_BENCH, "mock_zabbix.py")
+EXTRAER = os.path.join(DIR_FILES, "extraer_zabbix.py")
+PROCESAR = os.path.join(DIR_FILES, "procesar_reporte.py")
+
+# Modos de motor a comparar; {workers} se reemplaza por --workers
+MODOS = {
+    "requests": ["--motor", "requests", "--workers", "1"],
+    "hilos": ["--motor", "requests", "--workers", "{workers}"],
+    "async": ["--motor", "async", "--workers", "{workers}"],
+}
+
+# Medidas que se comparan contra la referencia (mayor = peor)
+MEDIDAS_REGRESION = ["tiempo_s", "rss_mb", "posts", "bajada_mb"]
+
+
+def ejecutar(comando, entorno=None):
+    """Corre un proceso y devuelve (código, segundos, RSS pico en MB)."""
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(comando, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # wait4 entrega el uso de recursos de este hijo (ru_maxrss en KB en Linux)
+    _, estado, uso = os.wait4(proceso.pid, 0)
+    segundos = time.perf_counter() - inicio
+    proceso.returncode = os.waitstatus_to_exitcode(estado)
+
+    if proceso.returncode != 0:
+        print(proceso.stderr.read().decode("utf-8", "replace")[-2000:], file=sys.stderr)
+    proceso.stderr.close()
+
+    return proceso.returncode, segundos, uso.ru_maxrss / 1024
+
+
+def estadisticas_mock(url, reiniciar=False):
+    with urllib.request.urlopen(url + "estadisticas" + ("?reiniciar=1" if reiniciar else ""), timeout=5) as r:
+        return json.loads(r.read())
+
+
+def levantar_mock(args, hosts):
+    proceso = subprocess.Popen([
+        sys.executable, MOCK,
+        "--puerto", str(args.puerto),
+        "--hosts", str(hosts),
+        "--latencia-ms", str(args.latencia_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--tasa-errores", str(args.tasa_errores),
+        "--max-filas", str(args.max_filas),
+    ], stderr=subprocess.DEVNULL)
+
+    url = f"http://127.0.0.1:{args.puerto}/"
+    for _ in range(100):
+        try:
+            estadisticas_mock(url)
+            return proceso, url
+        except OSError:
+            time.sleep(0.1)
+
+    proceso.kill()
+    raise SystemExit("[!] El mock de Zabbix no respondió")
+
+
+def objetivos_flota(hosts):
+    """Mezcla IPs, nombres visibles y hosts técnicos, más uno inexistente."""
+    objetivos = []
+    for n in range(hosts):
+        if n % 3 == 0:
+            objetivos.append(f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}")
+        elif n % 3 == 1:
+            objetivos.append(f"srv-{n:05d}")
+        else:
+            objetivos.append(f"srv-{n:05d}.bench")
+    objetivos.append("no-existe.bench")
+
+    grupos = {}
+    for n, objetivo in enumerate(objetivos):
+        grupos.setdefault(f"GRUPO_{n % 4}", []).append(objetivo)
+
+    return objetivos, grupos
+
+
+def medir(args, hosts, directorio):
+    objetivos, grupos = objetivos_flota(hosts)
+    fin = int(time.time()) // 3600 * 3600
+    inicio = fin - args.dias * 86400
+    fecha = lambda ts: datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+    proceso_mock, url = levantar_mock(args, hosts)
+    entorno = dict(os.environ, ZABBIX_URL=url, ZABBIX_TOKEN="benchmark")
+    resultados = []
+
+    try:
+        for modo in args.modos:
+            salida = os.path.join(directorio, f"bench_{hosts}_{modo}")
+            comando = [
+                sys.executable, EXTRAER,
+                "--objetivos", ",".join(objetivos),
+                "--grupos-json", json.dumps(grupos),
+                "--fecha-inicio", fecha(inicio),
+                "--fecha-fin", fecha(fin),
+                "--salida", salida,
+                "--solo-gzip",
+                "--fuente", args.fuente,
+            ] + [x.format(workers=args.workers) for x in MODOS[modo]]
+
+            estadisticas_mock(url, reiniciar=True)
+            codigo, segundos, rss = ejecutar(comando, entorno)
+            servidor = estadisticas_mock(url)
+
+            if codigo != 0:
+                print(f"[!] {hosts} hosts / {modo}: el extractor terminó con código {codigo}", file=sys.stderr)
+                continue
+
+            with gzip.open(salida + ".json.gz", "rt", encoding="utf-8") as fh:
+                payload = json.load(fh)
+            rendimiento = payload.get("rendimiento", {})
+            metodos = rendimiento.get("metodos", {})
+
+            resultado = {
+                "hosts": hosts,
+                "modo": modo,
+                "tiempo_s": round(segundos, 3),
+                "posts": servidor["posts"],
+                "llamadas": sum(servidor["llamadas"].values()),
+                "rss_mb": round(rss, 1),
+                "subida_mb": round(payload["trafico"]["subida_bytes"] / 1024 ** 2, 3),
+                "bajada_mb": round(payload["trafico"]["bajada_bytes"] / 1024 ** 2, 3),
+                "maquinas": len(payload["maquinas"]),
+                "reintentos": sum(m["reintentos"] for m in metodos.values()),
+                "particiones": sum(m.get("particiones", 0) for m in metodos.values()),
+                "fases_s": rendimiento.get("fases_segundos", {}),
+            }
+
+            if args.excel:
+                codigo, segundos, rss = ejecutar([
+                    sys.executable, PROCESAR,
+                    "--input", salida + ".json.gz",
+                    "--output", salida + ".xlsx",
+                ])
+                if codigo == 0:
+                    resultado["excel_tiempo_s"] = round(segundos, 3)
+                    resultado["excel_rss_mb"] = round(rss, 1)
+
+            resultados.append(resultado)
+            print(fila_tabla(resultado, args.excel), flush=True)
+    finally:
+        proceso_mock.terminate()
+        proceso_mock.wait()
+
+    return resultados
+
+
+def encabezado(excel):
+    columnas = f"{'Hosts':>6} {'Modo':<9} {'Tiempo s':>9} {'POSTs':>7} {'Llamadas':>9} " \
+               f"{'RSS MB':>8} {'Subida MB':>10} {'Bajada MB':>10} {'Reint.':>7} {'Partic.':>8}"
+    if excel:
+        columnas += f" {'Excel s':>8} {'RSS Excel':>10}"
+    return columnas
+
+
+def fila_tabla(r, excel):
+    fila = f"{r['hosts']:>6} {r['modo']:<9} {r['tiempo_s']:>9.2f} {r['posts']:>7} {r['llamadas']:>9} " \
+           f"{r['rss_mb']:>8.1f} {r['subida_mb']:>10.3f} {r['bajada_mb']:>10.3f} " \
+           f"{r['reintentos']:>7} {r['particiones']:>8}"
+    if excel:
+        fila += f" {r.get('excel_tiempo_s', 0):>8.2f} {r.get('excel_rss_mb', 0):>10.1f}"
+    return fila
+
+
+def comparar(resultados, referencia, tolerancia):
+    """Devuelve la lista de regresiones frente a la referencia."""
+    previos = {(r["hosts"], r["modo"]): r for r in referencia.get("resultados", [])}
+    regresiones = []
+
+    for r in resultados:
+        previo = previos.get((r["hosts"], r["modo"]))
+        if not previo:
+            continue
+
+        for medida in MEDIDAS_REGRESION:
+            antes = previo.get(medida)
+            ahora = r.get(medida)
+            if antes and ahora is not None and ahora > antes * (1 + tolerancia):
+                regresiones.append(
+                    f"{r['hosts']} hosts / {r['modo']}: {medida} {antes} -> {ahora} "
+                    f"(+{(ahora / antes - 1) * 100:.0f}%)"
+                )
+
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", default="10,100,1000",
+                        help="Tamaños de flota separados por coma (10 a 5000)")
+    parser.add_argument("--dias", type=float, default=7, help="Largo del rango consultado")
+    parser.add_argument("--fuente", choices=["auto", "hibrido", "trend", "history"], default="auto")
+    parser.add_argument("--modos", default=",".join(MODOS),
+                        help=f"Modos de motor separados por coma ({', '.join(MODOS)})")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latencia-ms", type=float, default=0, help="Latencia fija del mock por POST")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Latencia aleatoria extra del mock")
+    parser.add_argument("--tasa-errores", type=float, default=0, help="Fracción de POSTs con 502 en el mock")
+    parser.add_argument("--max-filas", type=int, default=0,
+                        help="Filas por POST desde las que el mock simula falta de memoria")
+    parser.add_argument("--puerto", type=int, default=8799)
+    parser.add_argument("--excel", action="store_true", help="Medir también procesar_reporte.py")
+    parser.add_argument("--resultado", default=None, help="Guardar los resultados en este JSON")
+    parser.add_argument("--referencia", default=None, help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25,
+                        help="Empeoramiento relativo admitido frente a la referencia")
+    args = parser.parse_args()
+
+    args.modos = [x.strip() for x in args.modos.split(",") if x.strip()]
+    desconocidos = [x for x in args.modos if x not in MODOS]
+    if desconocidos:
+        raise SystemExit(f"[!] Modos desconocidos: {', '.join(desconocidos)}")
+
+    tamanos = [int(x) for x in args.hosts.split(",") if x.strip()]
+
+    print(encabezado(args.excel))
+    resultados = []
+    with tempfile.TemporaryDirectory(prefix="bench_zabbix_") as directorio:
+        for hosts in tamanos:
+            resultados.extend(medir(args, hosts, directorio))
+
+    if args.resultado:
+        with open(args.resultado, "w", encoding="utf-8") as fh:
+            json.dump({
+                "generado": datetime.now().isoformat(),
+                "dias": args.dias,
+                "fuente": args.fuente,
+                "latencia_ms": args.latencia_ms,
+                "tasa_errores": args.tasa_errores,
+                "max_filas": args.max_filas,
+                "workers": args.workers,
+                "resultados": resultados,
+            }, fh, ensure_ascii=False, indent=2)
+        print(f"Resultados: {args.resultado}")
+
+    if args.referencia:
+        with open(args.referencia, encoding="utf-8") as fh:
+            regresiones = comparar(resultados, json.load(fh), args.tolerancia)
+
+        for regresion in regresiones:
+            print(f"[!] Regresión: {regresion}", file=sys.stderr)
+        if regresiones:
+            sys.exit(1)
+        print("Sin regresiones frente a la referencia.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Servidor JSON-RPC local que imita la API de Zabbix para medir
+extraer_zabbix.py sin un Zabbix real.
+
+Responde hostgroup.get, host.get, template.get, item.get, history.get,
+trend.get, trigger.get y usermacro.get (también en lotes JSON-RPC 2.0) con
+una flota sintética y determinista: cada host tiene los cuatro items que
+busca el extractor, está en el grupo "Bench/GRUPO_<n % 4>" con la etiqueta
+entorno=prod|qa (pares / impares) y las series se generan al vuelo, sin
+guardarse en memoria. Los triggers comparan contra macros de usuario
+({$CPU.UTIL.CRIT} en una plantilla anidada, redefinido en uno de cada cinco
+hosts; {$MEMORY.UTIL.MAX} global). GET /estadisticas devuelve los POST,
+llamadas por método y bytes atendidos (?reiniciar=1 pone los contadores
+en cero).
+
+Para probar la tolerancia a fallos, --tasa-errores responde 502 a una
+fracción de los POST y --max-filas responde como el frontend PHP sin
+memoria (HTTP 500, "Allowed memory size ... exhausted") cuando un POST
+devolvería más filas que ese tope.
+
+    python3 bench/mock_zabbix.py --hosts 1000 --latencia-ms 20
+    ZABBIX_URL=http://127.0.0.1:8765/ ZABBIX_TOKEN=x python3 ...extraer_zabbix.py ...
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Intervalo de muestreo (segundos) de los items estáticos: cambian poco
+INTERVALO_ESTATICO = 3600
+
+# Plantillas: todos los hosts enlazan la primera, que enlaza la segunda
+PLANTILLAS = {"20001": ["20002"], "20002": []}
+MACROS_PLANTILLA = {"20002": {"{$CPU.UTIL.CRIT}": "90"}}
+MACRO_CPU_HOST = "35"
+MACROS_GLOBALES = [
+    {"macro": "{$MEMORY.UTIL.MAX}", "value": "85", "type": "0"},
+    # Secreto: la API no devuelve el valor
+    {"macro": "{$CLAVE.SNMP}", "type": "1"},
+]
+
+ITEMS_HOST = [
+    # (nombre, key_, value_type, units)
+    ("Linux: Number of CPUs", "system.cpu.num", "3", ""),
+    ("Linux: Total memory", "vm.memory.size[total]", "3", "B"),
+    ("Linux: CPU utilization", "system.cpu.util", "0", "%"),
+    ("Linux: Memory utilization", "vm.memory.utilization", "0", "%"),
+    # Items de relleno: el extractor los descarta al seleccionar
+    ("Linux: Load average (1m avg)", "system.cpu.load[all,avg1]", "0", ""),
+    ("Linux: Available memory", "vm.memory.size[available]", "3", "B"),
+]
+
+
+class Flota:
+    """Hosts e items sintéticos; los valores dependen solo de (itemid, clock)."""
+
+    def __init__(self, hosts, intervalo):
+        self.intervalo = intervalo
+        self.hosts = []
+        self.items = {}
+        self.items_por_host = {}
+
+        for n in range(hosts):
+            hostid = str(10001 + n)
+            self.hosts.append({
+                "hostid": hostid,
+                "name": f"srv-{n:05d}",
+                "host": f"srv-{n:05d}.bench",
+                "groupid": str(n % 4 + 1),
+                "tags": [{"tag": "entorno", "value": "qa" if n % 2 else "prod"}],
+                "interfaces": [{
+                    "ip": f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}",
+                    "dns": "",
+                    "main": "1",
+                    "type": "1",
+                }],
+            })
+
+            propios = []
+            for k, (nombre, key_, value_type, units) in enumerate(ITEMS_HOST):
+                item = {
+                    "itemid": str((10001 + n) * 100 + k),
+                    "hostid": hostid,
+                    "name": nombre,
+                    "key_": key_,
+                    "units": units,
+                    "value_type": value_type,
+                }
+                self.items[item["itemid"]] = item
+                propios.append(item)
+            self.items_por_host[hostid] = propios
+
+        self.por_ip = {h["interfaces"][0]["ip"]: h for h in self.hosts}
+        self.por_name = {h["name"]: h for h in self.hosts}
+        self.por_host = {h["host"]: h for h in self.hosts}
+        self.por_id = {h["hostid"]: h for h in self.hosts}
+
+    def paso(self, item):
+        return INTERVALO_ESTATICO if item["value_type"] == "3" else self.intervalo
+
+    def valor(self, item, clock):
+        key_ = item["key_"]
+        semilla = int(item["itemid"])
+
+        if key_ == "system.cpu.num":
+            return 2 ** (semilla % 4 + 1)
+        if key_.startswith("vm.memory.size"):
+            return (semilla % 8 + 1) * 4 * 1024 ** 3
+
+        # Utilización: base por item + ciclo diario + ruido determinista
+        base = 15 + semilla % 50
+        ciclo = 20 * math.sin((clock % 86400) / 86400 * 2 * math.pi)
+        ruido = ((semilla * 2654435761 + clock * 40503) % 1000) / 100
+        return round(min(100.0, max(0.0, base + ciclo + ruido)), 4)
+
+
+def filtrar_hosts(flota, params):
+    filtro = params.get("filter") or {}
+    indices = (("ip", flota.por_ip), ("name", flota.por_name), ("host", flota.por_host))
+
+    hosts = flota.hosts
+    for campo, indice in indices:
+        if campo in filtro:
+            valores = filtro[campo]
+            valores = valores if isinstance(valores, list) else [valores]
+            hosts = [indice[v] for v in dict.fromkeys(valores) if v in indice]
+
+    if params.get("hostids"):
+        ids = {str(x) for x in params["hostids"]}
+        hosts = [h for h in hosts if h["hostid"] in ids]
+
+    if params.get("groupids"):
+        ids = {str(x) for x in params["groupids"]}
+        hosts = [h for h in hosts if h["groupid"] in ids]
+
+    # Solo operator 1 (igual) y 0 (contiene), combinadas con AND
+    for tag in params.get("tags") or []:
+        hosts = [
+            h for h in hosts
+            if any(
+                t["tag"] == tag["tag"] and (
+                    t["value"] == tag.get("value", "") if str(tag.get("operator", 0)) == "1"
+                    else tag.get("value", "") in t["value"]
+                )
+                for t in h["tags"]
+            )
+        ]
+
+    salida = []
+    for h in hosts:
+        fila = {"hostid": h["hostid"], "name": h["name"], "host": h["host"]}
+        if "selectInterfaces" in params:
+            fila["interfaces"] = h["interfaces"]
+        if "selectParentTemplates" in params:
+            fila["parentTemplates"] = [{"templateid": "20001"}]
+        salida.append(fila)
+    return salida
+
+
+def host_get(flota, params):
+    return filtrar_hosts(flota, params)
+
+
+def hostgroup_get(flota, params):
+    grupos = [{"groupid": str(n + 1), "name": f"Bench/GRUPO_{n}"} for n in range(4)]
+    nombres = (params.get("filter") or {}).get("name")
+    if nombres is not None:
+        nombres = nombres if isinstance(nombres, list) else [nombres]
+        grupos = [g for g in grupos if g["name"] in nombres]
+    return grupos
+
+
+def template_get(flota, params):
+    ids = [str(x) for x in params.get("templateids") or PLANTILLAS]
+    salida = []
+    for templateid in ids:
+        if templateid in PLANTILLAS:
+            fila = {"templateid": templateid}
+            if "selectParentTemplates" in params:
+                fila["parentTemplates"] = [{"templateid": t} for t in PLANTILLAS[templateid]]
+            salida.append(fila)
+    return salida
+
+
+def usermacro_get(flota, params):
+    if params.get("globalmacro"):
+        return [dict(m) for m in MACROS_GLOBALES]
+
+    salida = []
+    for hostid in (str(x) for x in params.get("hostids") or []):
+        for macro, valor in MACROS_PLANTILLA.get(hostid, {}).items():
+            salida.append({"hostid": hostid, "macro": macro, "value": valor, "type": "0"})
+        if hostid in flota.por_id and int(hostid) % 5 == 1:
+            salida.append({"hostid": hostid, "macro": "{$CPU.UTIL.CRIT}", "value": MACRO_CPU_HOST, "type": "0"})
+    return salida
+
+
+def item_get(flota, params):
+    hostids = params.get("hostids")
+    if hostids is not None:
+        hostids = hostids if isinstance(hostids, list) else [hostids]
+        items = [i for h in hostids for i in flota.items_por_host.get(str(h), [])]
+    else:
+        items = list(flota.items.values())
+
+    if params.get("itemids"):
+        ids = {str(x) for x in params["itemids"]}
+        items = [i for i in items if i["itemid"] in ids]
+
+    terminos = [t.lower() for t in (params.get("search") or {}).get("name", [])]
+    if terminos:
+        items = [i for i in items if any(t in i["name"].lower() for t in terminos)]
+
+    return [dict(i) for i in items]
+
+
+def history_get(flota, params):
+    value_type = str(params.get("history", 3))
+    items = [
+        flota.items[str(x)] for x in params.get("itemids", [])
+        if str(x) in flota.items and flota.items[str(x)]["value_type"] == value_type
+    ]
+    if not items:
+        return []
+
+    hasta = int(params.get("time_till", time.time()))
+    desde = int(params.get("time_from", hasta - 86400))
+    limite = int(params.get("limit") or 0) or None
+    descendente = params.get("sortorder") == "DESC"
+    paso = flota.paso(items[0])
+
+    primero = desde + (-desde) % paso
+    ultimo = hasta - hasta % paso
+    clocks = range(ultimo, primero - 1, -paso) if descendente else range(primero, ultimo + 1, paso)
+
+    filas = []
+    for clock in clocks:
+        for item in items:
+            filas.append({"itemid": item["itemid"], "clock": str(clock), "value": str(flota.valor(item, clock))})
+        if limite and len(filas) >= limite:
+            return filas[:limite]
+    return filas
+
+
+def trend_get(flota, params):
+    items = [flota.items[str(x)] for x in params.get("itemids", []) if str(x) in flota.items]
+    hasta = int(params.get("time_till", time.time()))
+    desde = int(params.get("time_from", hasta - 86400))
+    limite = int(params.get("limit") or 0) or None
+
+    filas = []
+    for hora in range(desde + (-desde) % 3600, hasta + 1, 3600):
+        for item in items:
+            # Promedio en la media hora y extremos derivados: barato y estable
+            avg = flota.valor(item, hora + 1800)
+            margen = (int(item["itemid"]) + hora // 3600) % 7
+            filas.append({
+                "itemid": item["itemid"],
+                "clock": str(hora),
+                "num": str(3600 // flota.paso(item)),
+                "value_avg": str(avg),
+                "value_max": str(round(min(100.0, avg + margen), 4) if item["value_type"] == "0" else avg),
+                "value_min": str(round(max(0.0, avg - margen), 4) if item["value_type"] == "0" else avg),
+            })
+        if limite and len(filas) >= limite:
+            return filas[:limite]
+    return filas
+
+
+def trigger_get(flota, params):
+    salida = []
+    for itemid in params.get("itemids", []):
+        item = flota.items.get(str(itemid))
+        if not item or item["key_"] not in ("system.cpu.util", "vm.memory.utilization"):
+            continue
+
+        host = flota.por_id[item["hostid"]]["host"]
+        trigger = {
+            "triggerid": str(int(item["itemid"]) * 10),
+            "description": f"High {item['name'].split(': ', 1)[-1].lower()}",
+            "expression": (
+                f"min(/{host}/{item['key_']},5m)>"
+                + ("{$CPU.UTIL.CRIT}" if "cpu" in item["key_"] else '{$MEMORY.UTIL.MAX:"prod"}')
+            ),
+        }
+        if "selectItems" in params:
+            trigger["items"] = [{"itemid": item["itemid"]}]
+        salida.append(trigger)
+    return salida
+
+
+METODOS = {
+    "hostgroup.get": hostgroup_get,
+    "host.get": host_get,
+    "template.get": template_get,
+    "item.get": item_get,
+    "history.get": history_get,
+    "trend.get": trend_get,
+    "trigger.get": trigger_get,
+    "usermacro.get": usermacro_get,
+}
+
+
+class Estadisticas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.posts = 0
+            self.llamadas = {}
+            self.bytes_recibidos = 0
+            self.bytes_enviados = 0
+
+    def registrar(self, metodos, recibidos, enviados):
+        with self._lock:
+            self.posts += 1
+            self.bytes_recibidos += recibidos
+            self.bytes_enviados += enviados
+            for metodo in metodos:
+                self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+
+    def a_dict(self):
+        with self._lock:
+            return {
+                "posts": self.posts,
+                "llamadas": dict(self.llamadas),
+                "bytes_recibidos": self.bytes_recibidos,
+                "bytes_enviados": self.bytes_enviados,
+            }
+
+
+# Lo que imprime PHP cuando una respuesta no entra en memory_limit
+ERROR_MEMORIA = (
+    b"PHP Fatal error:  Allowed memory size of 134217728 bytes exhausted "
+    b"(tried to allocate 20480 bytes) in /usr/share/zabbix/include/classes/api/CApiService.php"
+)
+
+
+def crear_manejador(flota, estadisticas, latencia_ms, jitter_ms, tasa_errores=0, max_filas=0):
+    def despachar(pedido):
+        metodo = pedido.get("method")
+        respuesta = {"jsonrpc": "2.0", "id": pedido.get("id")}
+
+        if metodo not in METODOS:
+            respuesta["error"] = {"code": -32601, "message": "Method not found.", "data": str(metodo)}
+        else:
+            respuesta["result"] = METODOS[metodo](flota, pedido.get("params") or {})
+        return respuesta
+
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            pedido = json.loads(cuerpo)
+
+            if latencia_ms or jitter_ms:
+                time.sleep((latencia_ms + random.uniform(0, jitter_ms)) / 1000)
+
+            if isinstance(pedido, list):
+                respuesta = [despachar(x) for x in pedido]
+                metodos = [x.get("method") for x in pedido]
+                filas = sum(len(x.get("result") or []) for x in respuesta)
+            else:
+                respuesta = despachar(pedido)
+                metodos = [pedido.get("method")]
+                filas = len(respuesta.get("result") or [])
+
+            if tasa_errores and random.random() < tasa_errores:
+                datos = b"<html><body><h1>502 Bad Gateway</h1></body></html>"
+                estadisticas.registrar(metodos, len(cuerpo), len(datos))
+                self._responder(datos, 502, "text/html")
+                return
+
+            if max_filas and filas > max_filas:
+                estadisticas.registrar(metodos, len(cuerpo), len(ERROR_MEMORIA))
+                self._responder(ERROR_MEMORIA, 500, "text/html")
+                return
+
+            datos = json.dumps(respuesta).encode("utf-8")
+            estadisticas.registrar(metodos, len(cuerpo), len(datos))
+            self._responder(datos)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            datos = json.dumps(estadisticas.a_dict()).encode("utf-8")
+            if parse_qs(url.query).get("reiniciar"):
+                estadisticas.reiniciar()
+            self._responder(datos)
+
+        def _responder(self, datos, estado=200, tipo="application/json"):
+            self.send_response(estado)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def log_message(self, *args):
+            pass
+
+    return Manejador
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--hosts", type=int, default=100, help="Tamaño de la flota sintética")
+    parser.add_argument("--intervalo", type=int, default=60,
+                        help="Segundos entre muestras de history para los items de utilización")
+    parser.add_argument("--latencia-ms", type=float, default=0,
+                        help="Latencia fija agregada a cada POST")
+    parser.add_argument("--jitter-ms", type=float, default=0,
+                        help="Latencia aleatoria extra (0..jitter) por POST")
+    parser.add_argument("--tasa-errores", type=float, default=0,
+                        help="Fracción de POSTs que responden 502 (0..1)")
+    parser.add_argument("--max-filas", type=int, default=0,
+                        help="Filas por POST a partir de las cuales se simula falta de memoria (0 = sin tope)")
+    args = parser.parse_args()
+
+    flota = Flota(args.hosts, args.intervalo)
+    estadisticas = Estadisticas()
+    servidor = ThreadingHTTPServer(
+        ("127.0.0.1", args.puerto),
+        crear_manejador(
+            flota, estadisticas, args.latencia_ms, args.jitter_ms, args.tasa_errores, args.max_filas
+        ),
+    )
+    servidor.daemon_threads = True
+
+    print(f"Mock Zabbix en http://127.0.0.1:{args.puerto}/ ({args.hosts} hosts)", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Re-agrega sin conexión las series crudas que deja extraer_zabbix.py con
+--series-crudas, para recortar otro rango o cambiar el período sin volver
+a consultar la API de Zabbix.
+
+El .parquet se abre con memory_map (requiere pyarrow); del .npz numpy
+carga solo las columnas usadas. Los diccionarios (itemid, hostid, grupo,
+metrica) se agrupan por código, sin pasar por textos.
+
+    python3 bench/reagregar_series.py --entrada reporte.parquet --periodo dia --salida dia.csv
+    python3 bench/reagregar_series.py --entrada reporte.npz --desde "2024-01-01 00:00:00" --metrica "CPU utilization"
+"""
+
+import argparse
+import csv
+import time
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+PERIODOS = {"hora": 3600, "dia": 86400, "total": 0}
+COLUMNAS = ["clock", "valor", "minimo", "maximo", "num", "hostid", "grupo", "metrica"]
+
+
+def leer_columnas(ruta):
+    """Devuelve (columnas numpy, diccionarios de hostid/grupo/metrica)."""
+    if ruta.endswith(".parquet"):
+        if pq is None:
+            raise SystemExit("[!] Falta pyarrow para leer .parquet")
+        tabla = pq.read_table(ruta, columns=COLUMNAS, memory_map=True)
+        columnas, diccionarios = {}, {}
+        for nombre in COLUMNAS:
+            # Cada row group trae su diccionario; se unifican antes de usar los códigos
+            columna = tabla.column(nombre)
+            if hasattr(columna.type, "index_type"):
+                columna = columna.unify_dictionaries().combine_chunks()
+                diccionarios[nombre] = columna.dictionary.to_numpy(zero_copy_only=False)
+                columna = columna.indices
+            columnas[nombre] = columna.to_numpy()
+        return columnas, diccionarios
+
+    with np.load(ruta) as npz:
+        columnas = {c: npz[c] for c in COLUMNAS}
+        diccionarios = {c: npz[c + "_valores"] for c in ("hostid", "grupo", "metrica")}
+    return columnas, diccionarios
+
+
+def reagregar(columnas, periodo):
+    """
+    Agrupa por (hostid, metrica, período) con una clave int64 ordenada y
+    ufunc.reduceat. El promedio pondera cada punto por num (1 en history,
+    muestras de la hora en trend), igual que el modo híbrido del extractor.
+    Devuelve (hostid, metrica, período, avg, max, min, puntos) por grupo.
+    """
+    clock = columnas["clock"]
+    base = int(clock.min()) // periodo * periodo if periodo and len(clock) else 0
+    periodos = (clock - base) // periodo if periodo else np.zeros_like(clock)
+    metricas = int(columnas["metrica"].max()) + 1 if len(clock) else 1
+    tramos = int(periodos.max()) + 1 if len(clock) else 1
+    clave = (columnas["hostid"].astype(np.int64) * metricas + columnas["metrica"]) * tramos + periodos
+
+    orden = np.argsort(clave, kind="stable")
+    clave = clave[orden]
+    inicios = np.flatnonzero(np.r_[True, clave[1:] != clave[:-1]]) if len(clave) else np.empty(0, dtype=np.int64)
+    if not len(inicios):
+        vacio = np.empty(0)
+        return vacio, vacio, vacio, vacio, vacio, vacio, vacio
+
+    valor = columnas["valor"][orden]
+    pesos = np.where(np.isnan(valor), 0, np.maximum(columnas["num"][orden], 1)).astype(np.float64)
+    suma = np.add.reduceat(np.nan_to_num(valor) * pesos, inicios)
+    peso = np.add.reduceat(pesos, inicios)
+    maximo = np.fmax.reduceat(columnas["maximo"][orden], inicios)
+    minimo = np.fmin.reduceat(columnas["minimo"][orden], inicios)
+    puntos = np.diff(np.r_[inicios, len(clave)])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        promedio = suma / peso
+
+    claves = clave[inicios]
+    return (
+        claves // tramos // metricas,
+        claves // tramos % metricas,
+        base + claves % tramos * periodo,
+        promedio, maximo, minimo, puntos,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entrada", required=True, help="Archivo .parquet o .npz de --series-crudas")
+    parser.add_argument("--periodo", choices=list(PERIODOS), default="total")
+    parser.add_argument("--desde", default=None, help="Recortar desde (YYYY-MM-DD HH:MM:SS)")
+    parser.add_argument("--hasta", default=None, help="Recortar hasta (YYYY-MM-DD HH:MM:SS)")
+    parser.add_argument("--metrica", default=None, help="Solo esta métrica (nombre del reporte)")
+    parser.add_argument("--salida", default=None, help="CSV de salida (por defecto solo se informa el tiempo)")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    columnas, diccionarios = leer_columnas(args.entrada)
+    lectura = time.perf_counter() - inicio
+
+    filtro = np.ones(len(columnas["clock"]), dtype=bool)
+    if args.desde:
+        filtro &= columnas["clock"] >= int(datetime.strptime(args.desde, "%Y-%m-%d %H:%M:%S").timestamp())
+    if args.hasta:
+        filtro &= columnas["clock"] <= int(datetime.strptime(args.hasta, "%Y-%m-%d %H:%M:%S").timestamp())
+    if args.metrica:
+        codigos = np.flatnonzero(diccionarios["metrica"] == args.metrica)
+        if not len(codigos):
+            raise SystemExit(f"[!] Métrica no encontrada: {args.metrica}")
+        filtro &= columnas["metrica"] == codigos[0]
+    if not filtro.all():
+        columnas = {c: v[filtro] for c, v in columnas.items()}
+
+    hostids, metricas, periodos, promedio, maximo, minimo, puntos = reagregar(columnas, PERIODOS[args.periodo])
+    total = time.perf_counter() - inicio
+
+    print(f"Puntos: {len(columnas['clock'])} | grupos: {len(puntos)}")
+    print(f"Lectura: {lectura:.3f} s | total: {total:.3f} s")
+
+    if not args.salida:
+        return
+
+    # Para saber a qué grupo de reporte pertenece cada host
+    grupo_host = dict(zip(columnas["hostid"].tolist(), columnas["grupo"].tolist()))
+
+    with open(args.salida, "w", newline="", encoding="utf-8") as fh:
+        escritor = csv.writer(fh)
+        escritor.writerow(["hostid", "grupo", "metrica", "periodo", "avg", "max", "min", "puntos"])
+        for hostid, metrica, periodo, avg, mx, mn, n in zip(hostids, metricas, periodos, promedio, maximo, minimo, puntos):
+            escritor.writerow([
+                diccionarios["hostid"][hostid],
+                diccionarios["grupo"][grupo_host[hostid]],
+                diccionarios["metrica"][metrica],
+                datetime.fromtimestamp(periodo).strftime("%Y-%m-%d %H:%M:%S") if args.periodo != "total" else "",
+                None if np.isnan(avg) else round(float(avg), 4),
+                None if np.isnan(mx) else float(mx),
+                None if np.isnan(mn) else float(mn),
+                int(n),
+            ])
+    print(f"CSV: {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,33 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import functools
 import gzip
+import hashlib
+import heapq
+import itertools
 import json
+import math
+import operator
 import os
+import queue
+import random
+import re
+import shutil
+import sqlite3
 import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
+import numpy as np
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 
 try:
     from dotenv import load_dotenv
@@ -16,6 +35,22 @@ try:
 except ImportError:
     pass
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
@@ -46,78 +81,945 @@ METRICAS = [
     },
 ]
 
+# Consultas de series en bloque: items por llamada y filas máximas por
+# respuesta (history.get se pagina por clock para no llegar al límite de
+# memoria del frontend).
+ITEMS_POR_LOTE = 200
+FILAS_POR_PAGINA = 50000
+
+# Motor async: llamadas JSON-RPC por cada POST en lote.
+LLAMADAS_POR_POST = 50
+
+# Percentiles: error relativo del sketch y máximo de buckets por serie.
+SKETCH_ALPHA = 0.01
+SKETCH_MAX_BUCKETS = 2048
+PERCENTILES = [("p50", 0.50), ("p95", 0.95), ("p99", 0.99)]
+
+# Hosts con mayor p95 de CPU que se listan por grupo en "grupos".
+TOP_HOSTS_GRUPO = 10
+
+# Selectores en --objetivos / --grupos-json: todos los hosts de un grupo de
+# Zabbix ("grupo:Linux servers") o con una etiqueta ("tag:entorno=prod";
+# "tag:entorno" = con cualquier valor).
+PREFIJO_GRUPO = "grupo:"
+PREFIJO_TAG = "tag:"
+
+# Umbral de un trigger: la primera comparación contra un número (con sufijo
+# de Zabbix) o un macro de usuario, p. ej. "min(/h/system.cpu.util,5m)>{$CPU.UTIL.CRIT}".
+PATRON_UMBRAL = re.compile(r"(<>|<=|>=|=|<|>)\s*(-?\d+(?:\.\d+)?[KMGTsmhdw]?|\{\$[^}]+\})")
+SUFIJOS_ZABBIX = {
+    "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4,
+    "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800,
+}
+COMPARADORES = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt,
+    "<=": operator.le, "=": operator.eq, "<>": operator.ne,
+}
+
+# Rollups: horario laboral (lunes a viernes, [inicio, fin) en hora local).
+HORARIO_LABORAL = (8, 18)
+
+# Caché de tendencias: una hora se considera cerrada (inmutable) cuando
+# pasó este margen desde su final, para dar tiempo a que Zabbix la escriba.
+MARGEN_CIERRE_HORA = 900
+
+# Ventanas (segundos hacia atrás) para buscar el último valor en bloque.
+VENTANAS_ULTIMO = [3600, 86400, 7 * 86400]
+
+# Reintentos ante timeouts, 429 y 5xx: espera exponencial con jitter
+# (ESPERA_BASE * 2^n, tope ESPERA_MAX, entre la mitad y el total).
+REINTENTOS_MAX = 4
+ESPERA_BASE = 1.0
+ESPERA_MAX = 30.0
+
+# Concurrencia adaptativa (AIMD): sube de a una solicitud por ventana sin
+# problemas y baja a la mitad ante errores o si la latencia reciente de un
+# método supera FACTOR_LATENCIA veces su latencia de largo plazo. La
+# latencia se normaliza por cada BYTES_POR_LATENCIA bytes de respuesta
+# (una página llena no es "lenta" frente a una vacía) y se juzga recién
+# con MUESTRAS_LATENCIA respuestas del método.
+FACTOR_LATENCIA = 3.0
+BYTES_POR_LATENCIA = 256 * 1024
+MUESTRAS_LATENCIA = 5
+
+# Páginas de series que una tarea puede adelantar antes de que se consuman.
+PAGINAS_EN_COLA = 2
+
+
+def lotes(lista, tamano):
+    for i in range(0, len(lista), tamano):
+        yield lista[i:i + tamano]
+
+
+def agrupar_por_tipo(items):
+    por_tipo = {}
+    for item in items:
+        por_tipo.setdefault(str(item["value_type"]), []).append(item["itemid"])
+    return por_tipo
+
+
+def repartir_filas(filas):
+    """Agrupa filas de varios items por itemid, cada grupo ordenado por clock."""
+    por_item = {}
+    for fila in sorted(filas, key=lambda f: int(f["clock"])):
+        por_item.setdefault(fila["itemid"], []).append(fila)
+    return por_item.items()
+
+
+def params_host(campo, objetivos):
+    return {
+        "output": ["hostid", "name", "host"],
+        "selectInterfaces": ["ip", "dns", "main", "type"],
+        "filter": {campo: objetivos},
+    }
+
+
+def mapa_hosts(campo, hosts):
+    mapa = {}
+    for host in hosts:
+        if campo == "ip":
+            claves = [i.get("ip") for i in host.get("interfaces", [])]
+        else:
+            claves = [host.get(campo)]
+
+        for clave in claves:
+            # Igual que antes, gana el primer host que devuelve la API
+            mapa.setdefault(clave, host)
+    return mapa
+
+
+def es_selector(objetivo):
+    return objetivo.startswith((PREFIJO_GRUPO, PREFIJO_TAG))
+
+
+def params_selectores(selectores, groupids):
+    """
+    host.get de cada selector ({selector: params}), con los mismos campos que
+    params_host y ordenado por nombre para que la expansión sea estable.
+    groupids es {nombre del grupo: groupid}; un grupo que no existe se avisa
+    y se omite.
+    """
+    params = {}
+    for selector in selectores:
+        base = {
+            "output": ["hostid", "name", "host"],
+            "selectInterfaces": ["ip", "dns", "main", "type"],
+            "sortfield": "name",
+        }
+
+        if selector.startswith(PREFIJO_GRUPO):
+            nombre = selector[len(PREFIJO_GRUPO):]
+            if nombre not in groupids:
+                print(f"[!] No se encontró el grupo de hosts: {nombre}", file=sys.stderr)
+                continue
+            base["groupids"] = [groupids[nombre]]
+        else:
+            # operator 1 = igual; 0 (contiene) con valor vacío = cualquier valor
+            etiqueta, _, valor = selector[len(PREFIJO_TAG):].partition("=")
+            base["tags"] = [{"tag": etiqueta, "value": valor, "operator": 1 if valor else 0}]
+
+        params[selector] = base
+    return params
+
+
+def params_macros(ids):
+    """usermacro.get de los macros de esos hosts/plantillas y de los globales."""
+    return [
+        ("usermacro.get", {"output": ["hostid", "macro", "value", "type"], "hostids": list(ids)}),
+        ("usermacro.get", {"output": ["macro", "value", "type"], "globalmacro": True}),
+    ]
+
+
+def params_ultimo(value_type, lote, desde):
+    return {
+        "output": ["itemid", "clock", "value"],
+        "itemids": lote,
+        "history": value_type,
+        "time_from": desde,
+        "sortfield": "clock",
+        "sortorder": "DESC",
+        "limit": FILAS_POR_PAGINA,
+    }
+
+
+def params_serie(tarea):
+    metodo, value_type, lote, desde, hasta = tarea
+
+    if metodo == "trend.get":
+        return {
+            "output": ["itemid", "clock", "num", "value_avg", "value_max", "value_min"],
+            "itemids": lote,
+            "time_from": desde,
+            "time_till": hasta,
+            "sortfield": "clock",
+            "sortorder": "ASC",
+        }
+
+    return {
+        "output": ["itemid", "clock", "value"],
+        "itemids": lote,
+        "history": value_type,
+        "time_from": desde,
+        "time_till": hasta,
+        "sortfield": "clock",
+        "sortorder": "ASC",
+        "limit": FILAS_POR_PAGINA,
+    }
+
+
+def avanzar_pagina(tarea, filas):
+    """
+    Devuelve (filas completas, tarea de la página siguiente o None).
+    history.get se pagina por clock: la página siguiente empieza en el
+    último clock recibido y las filas de ese segundo se vuelven a pedir.
+    """
+    metodo, value_type, lote, desde, hasta = tarea
+
+    if metodo == "trend.get" or len(filas) < FILAS_POR_PAGINA:
+        return filas, None
+
+    ultimo = int(filas[-1]["clock"])
+    completas = [f for f in filas if int(f["clock"]) < ultimo]
+
+    if not completas:
+        # Página llena con un solo segundo: se acepta tal cual
+        return filas, (metodo, value_type, lote, ultimo + 1, hasta)
+
+    return completas, (metodo, value_type, lote, ultimo, hasta)
+
+
+def partir_params(params):
+    """
+    Parte en dos una llamada demasiado grande para el frontend: divide la
+    primera lista de ids (o de valores de filtro) con más de un elemento.
+    Devuelve None si no hay nada que partir.
+    """
+    for campo in ("itemids", "hostids", "groupids", "triggerids"):
+        valores = params.get(campo)
+        if isinstance(valores, list) and len(valores) > 1:
+            mitad = len(valores) // 2
+            return [{**params, campo: valores[:mitad]}, {**params, campo: valores[mitad:]}]
+
+    for campo, valores in (params.get("filter") or {}).items():
+        if isinstance(valores, list) and len(valores) > 1:
+            mitad = len(valores) // 2
+            return [
+                {**params, "filter": {**params["filter"], campo: valores[:mitad]}},
+                {**params, "filter": {**params["filter"], campo: valores[mitad:]}},
+            ]
+
+    return None
+
+
+def partir_tarea(tarea):
+    """
+    Parte una tarea de series conservando el orden por item: primero por
+    lote (cada mitad recorre el rango completo) y, con un solo item, por
+    tiempo. Devuelve None si ya no se puede partir.
+    """
+    metodo, value_type, lote, desde, hasta = tarea
+
+    if len(lote) > 1:
+        mitad = len(lote) // 2
+        return [(metodo, value_type, lote[:mitad], desde, hasta), (metodo, value_type, lote[mitad:], desde, hasta)]
+
+    if hasta > desde:
+        medio = desde + (hasta - desde) // 2
+        return [(metodo, value_type, lote, desde, medio), (metodo, value_type, lote, medio + 1, hasta)]
+
+    return None
+
+
+def es_error_memoria(texto):
+    """El frontend PHP de Zabbix responde así cuando una consulta no entra en memory_limit."""
+    texto = str(texto).lower()
+    return "allowed memory size" in texto or "out of memory" in texto
+
+
+def espera_reintento(intento):
+    return min(ESPERA_MAX, ESPERA_BASE * 2 ** (intento - 1)) * random.uniform(0.5, 1.0)
+
+
+def ultima_hora_cerrada(ahora=None):
+    """Clock de la última hora cuyo trend ya no cambia."""
+    ahora = int(time.time() if ahora is None else ahora)
+    return (ahora - MARGEN_CIERRE_HORA) // 3600 * 3600 - 3600
+
+
+def tramos_hibridos(inicio, fin):
+    """
+    Parte [inicio, fin] en (desde, hasta, usar_trends): trend.get para las
+    horas completas y cerradas del medio, history.get para los bordes
+    parciales (y para las horas que aún no están cerradas).
+    """
+    primera = -(-inicio // 3600) * 3600
+    limite = min((fin + 1) // 3600 * 3600, ultima_hora_cerrada() + 3600)
+
+    if primera >= limite:
+        return [(inicio, fin, False)]
+
+    tramos = []
+    if inicio < primera:
+        tramos.append((inicio, primera - 1, False))
+    tramos.append((primera, limite - 1, True))
+    if limite <= fin:
+        tramos.append((limite, fin, False))
+    return tramos
+
+
+def ventanas_comparacion(inicio, fin, n):
+    """
+    N ventanas contiguas del mismo largo que [inicio, fin], de la más antigua
+    a la actual (que es [inicio, fin]). El largo se redondea al minuto, así
+    "00:00:00 a 23:59:59" y "00:00:00 a 00:00:00" dan ventanas de días enteros.
+    """
+    largo = max(60, -(-(fin - inicio) // 60) * 60)
+    ventanas = [(inicio - k * largo, inicio - (k - 1) * largo - 1) for k in range(n - 1, 0, -1)]
+    return ventanas + [(inicio, fin)]
+
+
+def partir_ventanas(filas, ventanas):
+    """Reparte filas (en cualquier orden) por ventana según su clock."""
+    if len(ventanas) == 1:
+        return [filas]
+
+    inicios = np.array([desde for desde, _ in ventanas], dtype=np.int64)
+    clocks = np.fromiter((int(f["clock"]) for f in filas), dtype=np.int64, count=len(filas))
+    indices = np.clip(np.searchsorted(inicios, clocks, side="right") - 1, 0, len(ventanas) - 1)
+
+    partes = [[] for _ in ventanas]
+    for fila, indice in zip(filas, indices.tolist()):
+        partes[indice].append(fila)
+    return partes
+
+
+def deltas_periodo(actual, anterior):
+    """Diferencia (actual - anterior) de avg, max y percentiles entre dos ventanas."""
+    deltas = {}
+    for campo in ["avg", "max"] + [nombre for nombre, _ in PERCENTILES]:
+        a, b = actual.get(campo), anterior.get(campo)
+        deltas[campo] = round(a - b, 4) if a is not None and b is not None else None
+    return deltas
+
+
+class CacheTendencias:
+    """
+    Caché local (SQLite) de trend.get por itemid y hora. Las horas cerradas
+    no cambian, así que se guardan para siempre; solo se vuelven a pedir las
+    horas abiertas del final del rango. La tabla cobertura recuerda qué
+    horas ya se consultaron, aunque no trajeran datos.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.db = sqlite3.connect(ruta)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS tendencias (
+                itemid TEXT NOT NULL,
+                clock INTEGER NOT NULL,
+                value_avg TEXT,
+                value_max TEXT,
+                value_min TEXT,
+                num TEXT,
+                PRIMARY KEY (itemid, clock)
+            );
+            CREATE TABLE IF NOT EXISTS cobertura (
+                itemid TEXT NOT NULL,
+                desde INTEGER NOT NULL,
+                hasta INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS cobertura_itemid ON cobertura (itemid);
+        """)
+
+    def intervalos(self, itemid):
+        return self.db.execute(
+            "SELECT desde, hasta FROM cobertura WHERE itemid = ? ORDER BY desde",
+            (itemid,),
+        ).fetchall()
+
+    def faltantes(self, itemid, inicio, fin):
+        """Intervalos de horas (desde, hasta) de [inicio, fin] que no están en caché."""
+        primera = -(-inicio // 3600) * 3600
+        ultima = fin // 3600 * 3600
+        huecos = []
+        cursor = primera
+
+        for desde, hasta in self.intervalos(itemid):
+            if hasta < cursor:
+                continue
+            if desde > ultima:
+                break
+            if desde > cursor:
+                huecos.append((cursor, min(desde - 3600, ultima)))
+            cursor = max(cursor, hasta + 3600)
+
+        if cursor <= ultima:
+            huecos.append((cursor, ultima))
+
+        return huecos
+
+    def guardar(self, itemid, filas):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO tendencias VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    itemid,
+                    int(f["clock"]),
+                    f.get("value_avg"),
+                    f.get("value_max"),
+                    f.get("value_min"),
+                    f.get("num"),
+                )
+                for f in filas
+            ],
+        )
+
+    def marcar(self, itemid, desde, hasta):
+        if desde > hasta:
+            return
+
+        unidos = []
+        for a, b in sorted(self.intervalos(itemid) + [(desde, hasta)]):
+            if unidos and a <= unidos[-1][1] + 3600:
+                unidos[-1] = (unidos[-1][0], max(unidos[-1][1], b))
+            else:
+                unidos.append((a, b))
+
+        self.db.execute("DELETE FROM cobertura WHERE itemid = ?", (itemid,))
+        self.db.executemany(
+            "INSERT INTO cobertura VALUES (?, ?, ?)",
+            [(itemid, a, b) for a, b in unidos],
+        )
+
+    def leer(self, itemid, inicio, fin):
+        return [
+            {
+                "itemid": itemid,
+                "clock": str(clock),
+                "value_avg": avg,
+                "value_max": vmax,
+                "value_min": vmin,
+                "num": num,
+            }
+            for clock, avg, vmax, vmin, num in self.db.execute(
+                "SELECT clock, value_avg, value_max, value_min, num FROM tendencias "
+                "WHERE itemid = ? AND clock BETWEEN ? AND ? ORDER BY clock",
+                (itemid, inicio, fin),
+            )
+        ]
+
+    def iniciar_tramo(self):
+        self.db.execute("SAVEPOINT tramo")
+
+    def confirmar_tramo(self):
+        self.db.execute("RELEASE tramo")
+
+    def descartar_tramo(self):
+        """Deshace lo guardado y marcado desde iniciar_tramo."""
+        self.db.execute("ROLLBACK TO tramo")
+        self.db.execute("RELEASE tramo")
+
+    def commit(self):
+        self.db.commit()
+
+    def cerrar(self):
+        self.db.commit()
+        self.db.close()
+
+
+class CacheMetadatos:
+    """
+    Caché local (SQLite) con TTL de los metadatos que casi nunca cambian:
+    objetivo -> host, selector -> hosts, hostid -> items, itemid ->
+    triggers y hostid -> macros de usuario. Cada tipo se guarda como JSON
+    por clave; con refrescar=True se ignora lo guardado (pero se vuelve a
+    escribir).
+    """
+
+    def __init__(self, ruta, ttl, refrescar=False):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.refrescar = refrescar
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(ruta, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS metadatos (
+                tipo TEXT NOT NULL,
+                clave TEXT NOT NULL,
+                valor TEXT NOT NULL,
+                guardado INTEGER NOT NULL,
+                PRIMARY KEY (tipo, clave)
+            );
+            CREATE TABLE IF NOT EXISTS indice_items (
+                itemid TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                clave TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS indice_items_itemid ON indice_items (itemid);
+        """)
+
+    def obtener(self, tipo, claves):
+        if self.refrescar:
+            return {}
+
+        vigente = int(time.time()) - self.ttl
+        encontrados = {}
+
+        with self._lock:
+            for lote in lotes(list(claves), 500):
+                marcas = ",".join("?" * len(lote))
+                for clave, valor in self.db.execute(
+                    f"SELECT clave, valor FROM metadatos WHERE tipo = ? AND guardado >= ? "
+                    f"AND clave IN ({marcas})",
+                    [tipo, vigente] + lote,
+                ):
+                    encontrados[clave] = json.loads(valor)
+
+        return encontrados
+
+    def guardar(self, tipo, valores):
+        ahora = int(time.time())
+
+        with self._lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO metadatos VALUES (?, ?, ?, ?)",
+                [(tipo, clave, json.dumps(valor), ahora) for clave, valor in valores.items()],
+            )
+
+            if tipo.startswith("items"):
+                self.db.executemany(
+                    "DELETE FROM indice_items WHERE tipo = ? AND clave = ?",
+                    [(tipo, clave) for clave in valores],
+                )
+                self.db.executemany(
+                    "INSERT INTO indice_items VALUES (?, ?, ?)",
+                    [
+                        (item["itemid"], tipo, clave)
+                        for clave, items in valores.items()
+                        for item in items
+                    ],
+                )
+
+            self.db.commit()
+
+    def invalidar_items(self, itemids):
+        """Borra los items de los hosts que contienen estos itemids y sus triggers."""
+        with self._lock:
+            for itemid in itemids:
+                entradas = self.db.execute(
+                    "SELECT tipo, clave FROM indice_items WHERE itemid = ?", (itemid,)
+                ).fetchall()
+                for tipo, clave in entradas:
+                    self.db.execute("DELETE FROM metadatos WHERE tipo = ? AND clave = ?", (tipo, clave))
+                    self.db.execute("DELETE FROM indice_items WHERE tipo = ? AND clave = ?", (tipo, clave))
+                self.db.execute("DELETE FROM metadatos WHERE tipo = 'triggers' AND clave = ?", (itemid,))
+            self.db.commit()
+
+    def cerrar(self):
+        with self._lock:
+            self.db.commit()
+            self.db.close()
+
+
+class ErrorMemoria(Exception):
+    """La API no pudo responder por límite de memoria; hay que partir la consulta."""
+
+
+class LimiteAdaptativo:
+    """
+    Límite AIMD de solicitudes en vuelo, entre 1 y maximo. Cada método
+    lleva dos promedios móviles de latencia normalizada (reciente y de
+    largo plazo): si el reciente se dispara, o hay timeouts / 5xx, el límite
+    se reduce a la mitad (como mucho una vez por tiempo de respuesta); cada
+    respuesta normal lo sube 1/limite, o sea ~1 por ventana completa.
+    """
+
+    def __init__(self, maximo):
+        self.maximo = max(1, maximo)
+        self.limite = float(self.maximo)
+        self.en_vuelo = 0
+        self.latencias = {}
+        self.reducciones = 0
+        self.minimo = self.maximo
+        self._ultima_reduccion = 0.0
+        self._cond = threading.Condition()
+
+    def intentar_entrar(self):
+        with self._cond:
+            if self.en_vuelo >= int(self.limite):
+                return False
+            self.en_vuelo += 1
+            return True
+
+    def entrar(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.en_vuelo < int(self.limite))
+            self.en_vuelo += 1
+
+    def salir(self, metodo, segundos, bajada=0, sobrecarga=False):
+        with self._cond:
+            self.en_vuelo -= 1
+
+            costo = segundos / (1 + bajada / BYTES_POR_LATENCIA)
+            muestras, reciente, largo = self.latencias.get(metodo, (0, costo, costo))
+            reciente += 0.5 * (costo - reciente)
+            largo += 0.05 * (costo - largo)
+            self.latencias[metodo] = (muestras + 1, reciente, largo)
+            lenta = muestras >= MUESTRAS_LATENCIA and reciente > FACTOR_LATENCIA * largo
+
+            ahora = time.perf_counter()
+            if sobrecarga or lenta:
+                if ahora - self._ultima_reduccion > segundos:
+                    self.limite = max(1.0, self.limite / 2)
+                    self.reducciones += 1
+                    self.minimo = min(self.minimo, int(self.limite))
+                    self._ultima_reduccion = ahora
+            else:
+                self.limite = min(float(self.maximo), self.limite + 1 / self.limite)
+
+            self._cond.notify_all()
+
+    def a_dict(self):
+        with self._cond:
+            return {
+                "maximo": self.maximo,
+                "final": int(self.limite),
+                "minimo": self.minimo,
+                "reducciones": self.reducciones,
+            }
+
+
+class Instrumentacion:
+    """
+    Estadísticas de la extracción: por método de la API, llamadas, errores,
+    reintentos, particiones, bytes y latencia (p50/p95 con un
+    SketchCuantiles, más el máximo); por fase de main(), el tiempo de pared
+    acumulado; y, si hay un LimiteAdaptativo, cómo varió la concurrencia.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metodos = {}
+        self.fases = {}
+        self._abiertas = {}
+        self.limitador = None
+
+    def _metodo(self, metodo):
+        if metodo not in self.metodos:
+            self.metodos[metodo] = {
+                "llamadas": 0,
+                "errores": 0,
+                "reintentos": 0,
+                "particiones": 0,
+                "subida_bytes": 0,
+                "bajada_bytes": 0,
+                "latencia": SketchCuantiles(),
+                "latencia_max": 0.0,
+            }
+        return self.metodos[metodo]
+
+    def registrar(self, metodo, segundos, subida=0, bajada=0, error=False):
+        milisegundos = segundos * 1000
+        with self._lock:
+            datos = self._metodo(metodo)
+            datos["llamadas"] += 1
+            datos["errores"] += int(error)
+            datos["subida_bytes"] += subida
+            datos["bajada_bytes"] += bajada
+            datos["latencia"].agregar(milisegundos)
+            datos["latencia_max"] = max(datos["latencia_max"], milisegundos)
+
+    def reintento(self, metodo):
+        with self._lock:
+            self._metodo(metodo)["reintentos"] += 1
+
+    def particion(self, metodo):
+        with self._lock:
+            self._metodo(metodo)["particiones"] += 1
+
+    @contextmanager
+    def fase(self, nombre):
+        inicio = time.perf_counter()
+        self._abiertas[nombre] = inicio
+        try:
+            yield
+        finally:
+            del self._abiertas[nombre]
+            self.fases[nombre] = self.fases.get(nombre, 0.0) + time.perf_counter() - inicio
+
+    def a_dict(self):
+        """Las fases aún abiertas se informan con lo transcurrido hasta ahora."""
+        ahora = time.perf_counter()
+        fases = dict(self.fases)
+        for nombre, inicio in self._abiertas.items():
+            fases[nombre] = fases.get(nombre, 0.0) + ahora - inicio
+
+        with self._lock:
+            metodos = {
+                metodo: {
+                    "llamadas": datos["llamadas"],
+                    "errores": datos["errores"],
+                    "reintentos": datos["reintentos"],
+                    "particiones": datos["particiones"],
+                    "subida_bytes": datos["subida_bytes"],
+                    "bajada_bytes": datos["bajada_bytes"],
+                    "latencia_ms": {
+                        "p50": round(datos["latencia"].cuantil(0.5) or 0.0, 2),
+                        "p95": round(datos["latencia"].cuantil(0.95) or 0.0, 2),
+                        "max": round(datos["latencia_max"], 2),
+                    },
+                }
+                for metodo, datos in sorted(self.metodos.items())
+            }
+
+        resultado = {
+            "metodos": metodos,
+            "fases_segundos": {nombre: round(segundos, 3) for nombre, segundos in fases.items()},
+        }
+        if self.limitador is not None:
+            resultado["concurrencia"] = self.limitador.a_dict()
+        return resultado
+
 
 class Zabbix:
-    def __init__(self, url, token):
+    def __init__(self, url, token, workers=1, max_solicitudes=None, cache=None, metadatos=None,
+                 timeout=60, reintentos=REINTENTOS_MAX):
         self.url = url
         self.token = token
+        self.cache = cache
+        self.metadatos = metadatos
+        self.timeout = timeout
+        self.reintentos = max(0, reintentos)
         self.bytes_subida = 0
         self.bytes_bajada = 0
+        self.instrumentacion = Instrumentacion()
+
+        # Una sola sesión keep-alive compartida por todos los hilos; el pool
+        # de conexiones y el límite AIMD acotan las solicitudes en vuelo.
+        self.workers = max(1, workers)
+        self.limite = max(1, max_solicitudes or self.workers)
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=self.limite, pool_block=True)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+        self.limitador = LimiteAdaptativo(self.limite)
+        self.instrumentacion.limitador = self.limitador
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # Llamadas que terminaron en error de la API (y devolvieron []): quien
+        # guarda resultados en una caché compara este contador antes y después.
+        self.errores_api = 0
+
+    def nuevo_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def cerrar(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.cerrar()
+        if self.metadatos is not None:
+            self.metadatos.cerrar()
+
+    def error_api(self, method, params, error):
+        print(f"[!] Error API {method}: {error}", file=sys.stderr)
+        with self._lock:
+            self.errores_api += 1
+
+        # Un item borrado invalida los metadatos guardados que lo referencian
+        if self.metadatos is not None and params.get("itemids") and "exist" in str(error).lower():
+            self.metadatos.invalidar_items([str(x) for x in params["itemids"]])
+
+    def con_metadatos(self, tipo, claves, consultar):
+        """
+        Devuelve {clave: valor} usando la caché de metadatos; solo se llama a
+        consultar(claves_faltantes) para lo que no está guardado o venció.
+        """
+        claves = list(dict.fromkeys(claves))
+        if self.metadatos is None:
+            return consultar(claves)
+
+        encontrados = self.metadatos.obtener(tipo, claves)
+        faltantes = [x for x in claves if x not in encontrados]
+
+        if faltantes:
+            errores = self.errores_api
+            nuevos = consultar(faltantes)
+            # Con un error de la API los vacíos no son confirmados: se usan en
+            # esta ejecución pero no se guardan.
+            if self.errores_api == errores:
+                self.metadatos.guardar(tipo, nuevos)
+            else:
+                print(f"[!] metadatos {tipo}: sin guardar por errores de la API", file=sys.stderr)
+            encontrados.update(nuevos)
+
+        print(f"[metadatos] {tipo}: {len(claves) - len(faltantes)} en caché, {len(faltantes)} consultados")
+        return encontrados
+
+    def esperar_reintento(self, method, intento, error):
+        espera = espera_reintento(intento)
+        self.instrumentacion.reintento(method)
+        print(
+            f"[reintento] {method} {intento}/{self.reintentos} en {espera:.1f} s: {error}",
+            file=sys.stderr,
+        )
+        return espera
 
     def api(self, method, params):
+        """
+        Si el frontend se queda sin memoria, la llamada se parte en dos
+        (partir_params) y se unen los resultados.
+        """
+        try:
+            return self._api(method, params)
+        except ErrorMemoria as error:
+            partes = partir_params(params)
+            if not partes:
+                self.error_api(method, params, error)
+                return []
+
+            self.instrumentacion.particion(method)
+            return [fila for parte in partes for fila in self.api(method, parte)]
+
+    def _api(self, method, params):
+        """Un POST con reintentos (timeouts, 429 y 5xx); ErrorMemoria si no entra en memoria."""
         payload = {
             "jsonrpc": "2.0",
             "method": method,
             "params": params,
             "auth": self.token,
-            "id": 1,
+            "id": self.nuevo_id(),
         }
-
-        r = requests.post(
-            self.url,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            verify=False,
-            timeout=60,
-        )
-
-        self.bytes_subida += len(r.request.body or b"")
-        self.bytes_bajada += len(r.content or b"")
-
-        r.raise_for_status()
-        data = r.json()
-
-        if "error" in data:
-            print(f"[!] Error API {method}: {data['error']}", file=sys.stderr)
-            return []
-
-        return data.get("result", [])
+        error = None
+
+        for intento in range(self.reintentos + 1):
+            if intento:
+                time.sleep(self.esperar_reintento(method, intento, error))
+
+            self.limitador.entrar()
+            inicio = time.perf_counter()
+            try:
+                r = self.session.post(
+                    self.url,
+                    json=payload,
+                    headers={"Content-Type": "application/json"},
+                    verify=False,
+                    timeout=self.timeout,
+                )
+            except (requests.Timeout, requests.ConnectionError) as e:
+                segundos = time.perf_counter() - inicio
+                self.limitador.salir(method, segundos, sobrecarga=True)
+                self.instrumentacion.registrar(method, segundos, error=True)
+                error = e
+                continue
+            except requests.RequestException:
+                segundos = time.perf_counter() - inicio
+                self.limitador.salir(method, segundos)
+                self.instrumentacion.registrar(method, segundos, error=True)
+                raise
+
+            segundos = time.perf_counter() - inicio
+            subida = len(r.request.body or b"")
+            bajada = len(r.content or b"")
+            memoria = not r.ok and es_error_memoria(r.text)
+            sobrecarga = not memoria and (r.status_code == 429 or r.status_code >= 500)
+            self.limitador.salir(method, segundos, bajada, sobrecarga)
+            with self._lock:
+                self.bytes_subida += subida
+                self.bytes_bajada += bajada
+
+            if not r.ok:
+                self.instrumentacion.registrar(method, segundos, subida, bajada, error=True)
+                if memoria:
+                    raise ErrorMemoria(r.text[:300])
+                if sobrecarga:
+                    error = requests.HTTPError(f"{r.status_code} {r.reason}", response=r)
+                    continue
+                r.raise_for_status()
+
+            data = r.json()
+            self.instrumentacion.registrar(method, segundos, subida, bajada, error="error" in data)
+
+            if "error" in data:
+                if es_error_memoria(data["error"]):
+                    raise ErrorMemoria(data["error"])
+                self.error_api(method, params, data["error"])
+                return []
+
+            return data.get("result", [])
+
+        raise error
 
     def buscar_host(self, objetivo):
-        # Primero intenta por IP
-        hosts = self.api("host.get", {
-            "output": ["hostid", "name", "host"],
-            "selectInterfaces": ["ip", "dns", "main", "type"],
-            "filter": {"ip": [objetivo]},
-        })
-
-        # Luego por nombre visible
-        if not hosts:
-            hosts = self.api("host.get", {
-                "output": ["hostid", "name", "host"],
-                "selectInterfaces": ["ip", "dns", "main", "type"],
-                "filter": {"name": [objetivo]},
-            })
-
-        # Luego por host técnico
-        if not hosts:
-            hosts = self.api("host.get", {
-                "output": ["hostid", "name", "host"],
-                "selectInterfaces": ["ip", "dns", "main", "type"],
-                "filter": {"host": [objetivo]},
-            })
-
-        return hosts[0] if hosts else None
+        return self.buscar_hosts([objetivo]).get(objetivo)
+
+    def buscar_hosts(self, objetivos):
+        """
+        Resuelve todos los objetivos con un host.get por tipo de filtro
+        (IP, nombre visible, host técnico) en lugar de hasta tres llamadas
+        por objetivo. Se respeta la prioridad IP -> nombre -> host.
+        """
+        encontrados = {}
+        pendientes = list(dict.fromkeys(objetivos))
+
+        for campo in ("ip", "name", "host"):
+            if not pendientes:
+                break
+
+            mapa = mapa_hosts(campo, self.api("host.get", params_host(campo, pendientes)))
+
+            for objetivo in pendientes:
+                if objetivo in mapa:
+                    encontrados[objetivo] = mapa[objetivo]
+
+            pendientes = [x for x in pendientes if x not in encontrados]
+
+        return encontrados
+
+    def ids_grupos(self, selectores):
+        """Un solo hostgroup.get para todos los grupos nombrados: {nombre: groupid}."""
+        nombres = [x[len(PREFIJO_GRUPO):] for x in selectores if x.startswith(PREFIJO_GRUPO)]
+        if not nombres:
+            return {}
+
+        grupos = self.api("hostgroup.get", {"output": ["groupid", "name"], "filter": {"name": nombres}})
+        return {g["name"]: g["groupid"] for g in grupos}
+
+    def hosts_selectores(self, selectores):
+        """
+        Hosts de cada selector con un host.get por selector (no por host),
+        que ya trae hostid e interfaces. Los selectores sin hosts no se
+        devuelven, así no quedan guardados en la caché de metadatos.
+        """
+        params = params_selectores(selectores, self.ids_grupos(selectores))
+        resultado = {selector: self.api("host.get", p) for selector, p in params.items()}
+        return {k: v for k, v in resultado.items() if v}
 
     def obtener_items(self, hostid, terminos):
-        return self.api("item.get", {
-            "output": ["itemid", "name", "key_", "units", "value_type"],
-            "hostids": hostid,
+        return self.obtener_items_hosts([hostid], terminos).get(hostid, [])
+
+    def obtener_items_hosts(self, hostids, terminos):
+        """
+        Un solo item.get para todos los hosts; el resultado se reparte por
+        hostid conservando el orden por nombre que devuelve la API.
+        """
+        por_host = {hostid: [] for hostid in hostids}
+        if not hostids:
+            return por_host
+
+        items = self.api("item.get", {
+            "output": ["itemid", "hostid", "name", "key_", "units", "value_type"],
+            "hostids": list(hostids),
             "search": {"name": terminos},
             "searchByAny": True,
             "sortfield": "name",
         })
 
+        for item in items:
+            por_host.setdefault(item.get("hostid"), []).append(item)
+
+        return por_host
+
     def ultimo_valor(self, item):
         return self.api("history.get", {
             "output": ["clock", "value"],
@@ -128,68 +1030,728 @@ class Zabbix:
             "limit": 1,
         })
 
-    def datos_rango(self, item, inicio, fin, usar_trends):
-        if usar_trends:
-            return self.api("trend.get", {
-                "output": ["clock", "value_avg", "value_max", "value_min"],
-                "itemids": [item["itemid"]],
-                "time_from": inicio,
-                "time_till": fin,
-                "sortfield": "clock",
-                "sortorder": "ASC",
-            })
+    def ultimos_valores(self, items):
+        """
+        Último valor de varios items con un history.get por value_type y lote.
+        Se busca en ventanas crecientes hacia atrás; los items sin datos en
+        ninguna ventana se consultan uno a uno, igual que ultimo_valor.
+        """
+        resultado = {}
+        ahora = int(time.time())
+
+        for value_type, itemids in agrupar_por_tipo(items).items():
+            pendientes = list(dict.fromkeys(itemids))
+
+            for ventana in VENTANAS_ULTIMO:
+                if not pendientes:
+                    break
+
+                for lote in lotes(pendientes, ITEMS_POR_LOTE):
+                    for fila in self.api("history.get", params_ultimo(value_type, lote, ahora - ventana)):
+                        resultado.setdefault(fila["itemid"], [fila])
+
+                pendientes = [x for x in pendientes if x not in resultado]
+
+            for itemid in pendientes:
+                resultado[itemid] = self.ultimo_valor({"itemid": itemid, "value_type": value_type})
+
+        return resultado
+
+    def series_rango(self, items, inicio, fin, usar_trends):
+        """
+        Genera (itemid, filas) en orden de clock para varios items a la vez.
+        Con caché de tendencias solo se piden a la API las horas que faltan.
+        """
+        if usar_trends and self.cache is not None:
+            yield from self._series_con_cache(items, inicio, fin)
+        else:
+            yield from self._series_api(items, inicio, fin, usar_trends)
+
+    def _series_con_cache(self, items, inicio, fin):
+        cerrada = ultima_hora_cerrada()
+        unicos = list({i["itemid"]: i for i in items}.values())
+
+        # Items con los mismos huecos se piden juntos (lo normal: la cola del rango)
+        por_huecos = {}
+        for item in unicos:
+            huecos = tuple(self.cache.faltantes(item["itemid"], inicio, fin))
+            if huecos:
+                por_huecos.setdefault(huecos, []).append(item)
+
+        abiertas = {}
+        for huecos, grupo in por_huecos.items():
+            for desde, hasta in huecos:
+                # Un tramo con alguna llamada fallida no se guarda ni se marca
+                # como consultado: la próxima ejecución lo vuelve a pedir.
+                errores = self.errores_api
+                self.cache.iniciar_tramo()
+                for itemid, filas in self._series_api(grupo, desde, hasta, True):
+                    self.cache.guardar(itemid, [f for f in filas if int(f["clock"]) <= cerrada])
+                    abiertas.setdefault(itemid, []).extend(f for f in filas if int(f["clock"]) > cerrada)
+
+                if self.errores_api != errores:
+                    self.cache.descartar_tramo()
+                    print(f"[!] cache: tendencias de {len(grupo)} items sin guardar por errores de la API", file=sys.stderr)
+                    continue
+
+                for item in grupo:
+                    self.cache.marcar(item["itemid"], desde, min(hasta, cerrada))
+                self.cache.confirmar_tramo()
+
+        self.cache.commit()
+        print(
+            f"[cache] tendencias: {len(unicos)} items, "
+            f"{sum(len(g) for g in por_huecos.values())} con horas pendientes"
+        )
 
-        return self.api("history.get", {
-            "output": ["clock", "value"],
-            "itemids": [item["itemid"]],
-            "history": item["value_type"],
-            "time_from": inicio,
-            "time_till": fin,
-            "sortfield": "clock",
-            "sortorder": "ASC",
-        })
+        for item in unicos:
+            filas = self.cache.leer(item["itemid"], inicio, min(fin, cerrada))
+            filas.extend(abiertas.get(item["itemid"], []))
+            if filas:
+                yield item["itemid"], filas
+
+    def _series_api(self, items, inicio, fin, usar_trends):
+        """
+        Series directamente desde la API.
+
+        - trend.get: lotes de ITEMS_POR_LOTE items y ventanas de horas
+          calculadas para que cada respuesta no pase de FILAS_POR_PAGINA.
+        - history.get: lotes agrupados por value_type, paginados por clock
+          con limit (ver avanzar_pagina).
+
+        Con workers > 1 las tareas (lote + tramo de tiempo) se ejecutan en
+        paralelo y sus resultados se entregan en el mismo orden que en modo
+        secuencial.
+        """
+        tareas = self.tareas_series(items, inicio, fin, usar_trends)
+
+        if self.workers == 1:
+            for tarea in tareas:
+                for filas in self._paginas_tarea(tarea):
+                    yield from repartir_filas(filas)
+            return
+
+        # Cada tarea deja sus páginas en una cola acotada: un hilo no adelanta
+        # más de PAGINAS_EN_COLA páginas que todavía no se consumieron.
+        colas = [queue.Queue(maxsize=PAGINAS_EN_COLA) for _ in tareas]
+        cancelado = threading.Event()
+        fin_tarea = object()
+
+        def dejar(cola, elemento):
+            while not cancelado.is_set():
+                try:
+                    cola.put(elemento, timeout=0.2)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def trabajar(indice, tarea):
+            try:
+                for filas in self._paginas_tarea(tarea):
+                    if not dejar(colas[indice], filas):
+                        return
+                dejar(colas[indice], fin_tarea)
+            except Exception as error:
+                dejar(colas[indice], error)
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for indice, tarea in enumerate(tareas):
+                pool.submit(trabajar, indice, tarea)
+
+            for cola in colas:
+                while True:
+                    elemento = cola.get()
+                    if elemento is fin_tarea:
+                        break
+                    if isinstance(elemento, Exception):
+                        raise elemento
+                    yield from repartir_filas(elemento)
+        finally:
+            cancelado.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def tareas_series(self, items, inicio, fin, usar_trends):
+        """Tareas (metodo, value_type, lote, desde, hasta) de series_rango."""
+        tareas = []
+
+        if usar_trends:
+            itemids = list(dict.fromkeys(i["itemid"] for i in items))
+
+            for lote in lotes(itemids, ITEMS_POR_LOTE):
+                paso = max(1, FILAS_POR_PAGINA // len(lote)) * 3600
+                desde = inicio
+
+                while desde <= fin:
+                    hasta = min(fin, desde + paso - 1)
+                    tareas.append(("trend.get", None, lote, desde, hasta))
+                    desde = hasta + 1
+
+            return tareas
+
+        lotes_history = [
+            (value_type, lote)
+            for value_type, itemids in agrupar_por_tipo(items).items()
+            for lote in lotes(list(dict.fromkeys(itemids)), ITEMS_POR_LOTE)
+        ]
+
+        # Si hay más hilos que lotes, cada lote se parte en tramos de tiempo
+        # para que la paginación también avance en paralelo.
+        tramos = max(1, self.workers // max(1, len(lotes_history)))
+        paso = max(1, (fin - inicio + 1) // tramos)
+
+        for value_type, lote in lotes_history:
+            desde = inicio
+            while desde <= fin:
+                hasta = fin if desde + 2 * paso > fin + 1 else desde + paso - 1
+                tareas.append(("history.get", value_type, lote, desde, hasta))
+                desde = hasta + 1
+
+        return tareas
+
+    def _paginas_tarea(self, tarea):
+        """
+        Genera las páginas (filas completas) de una tarea. Si una página no
+        entra en la memoria del frontend, la tarea restante se parte
+        (partir_tarea) y las mitades se recorren en orden.
+        """
+        while tarea:
+            try:
+                filas = self._api(tarea[0], params_serie(tarea))
+            except ErrorMemoria as error:
+                partes = partir_tarea(tarea)
+                if not partes:
+                    self.error_api(tarea[0], params_serie(tarea), error)
+                    return
+
+                self.instrumentacion.particion(tarea[0])
+                for parte in partes:
+                    yield from self._paginas_tarea(parte)
+                return
+
+            filas, tarea = avanzar_pagina(tarea, filas)
+            yield filas
 
     def triggers(self, itemid):
-        return self.api("trigger.get", {
+        return self.triggers_items([itemid]).get(itemid, [])
+
+    def triggers_items(self, itemids):
+        """
+        Un solo trigger.get para todos los items; cada trigger se asigna a
+        los itemids que referencia su expresión.
+        """
+        por_item = {itemid: [] for itemid in itemids}
+        if not itemids:
+            return por_item
+
+        triggers = self.api("trigger.get", {
             "output": ["description", "expression"],
-            "itemids": [itemid],
+            "itemids": list(itemids),
+            "selectItems": ["itemid"],
             "expandDescription": True,
             "expandExpression": True,
         })
 
+        for trigger in triggers:
+            items = trigger.pop("items", [])
+            for item in items:
+                if item.get("itemid") in por_item:
+                    por_item[item["itemid"]].append(trigger)
+
+        return por_item
+
+    def linajes_plantillas(self, hostids):
+        """
+        {hostid: [hostid, plantillas...]} con las plantillas directas y
+        anidadas de cada host, de la más cercana a la más lejana (el orden
+        en que Zabbix busca un macro). Un host.get y un template.get por
+        nivel de anidamiento para toda la flota.
+        """
+        hosts = self.api("host.get", {
+            "output": ["hostid"],
+            "hostids": list(hostids),
+            "selectParentTemplates": ["templateid"],
+        })
+        padres = {h["hostid"]: [t["templateid"] for t in h.get("parentTemplates", [])] for h in hosts}
+
+        pendientes = {t for ids in padres.values() for t in ids if t not in padres}
+        while pendientes:
+            for templateid in pendientes:
+                padres[templateid] = []
+            plantillas = self.api("template.get", {
+                "output": ["templateid"],
+                "templateids": sorted(pendientes),
+                "selectParentTemplates": ["templateid"],
+            })
+            for plantilla in plantillas:
+                padres[plantilla["templateid"]] = [t["templateid"] for t in plantilla.get("parentTemplates", [])]
+            pendientes = {t for p in plantillas for t in padres[p["templateid"]] if t not in padres}
+
+        linajes = {}
+        for hostid in hostids:
+            linaje = []
+            cola = [hostid]
+            while cola:
+                actual = cola.pop(0)
+                if actual not in linaje:
+                    linaje.append(actual)
+                    cola.extend(padres.get(actual, []))
+            linajes[hostid] = linaje
+
+        return linajes
+
+    def consultar_macros(self, ids):
+        """(macros de esos hosts/plantillas, macros globales)."""
+        return tuple(self.api(method, params) for method, params in params_macros(ids))
+
+    def macros_hosts(self, hostids, nombres):
+        """
+        Macros de usuario efectivos de cada host, solo los de esos nombres
+        (sin contexto): el del host, si no el de la plantilla más cercana y
+        si no el global. Un solo usermacro.get trae los macros de todos los
+        hosts y plantillas de la flota (más uno para los globales); los
+        secretos y los de Vault no traen valor y se omiten.
+        """
+        hostids = list(hostids)
+        if not hostids:
+            return {}
+
+        linajes = self.linajes_plantillas(hostids)
+        de_hosts, globales = self.consultar_macros(sorted({x for linaje in linajes.values() for x in linaje}))
+
+        def usable(macro):
+            return str(macro.get("type", "0")) == "0" and nombre_macro(macro.get("macro", "")) in nombres
+
+        definidos = {}
+        for macro in de_hosts:
+            if usable(macro):
+                definidos.setdefault(macro["hostid"], {})[macro["macro"]] = macro.get("value", "")
+        base = {m["macro"]: m.get("value", "") for m in globales if usable(m)}
+
+        resultado = {}
+        for hostid in hostids:
+            efectivos = dict(base)
+            for id_ in reversed(linajes.get(hostid, [hostid])):
+                efectivos.update(definidos.get(id_, {}))
+            resultado[hostid] = efectivos
+
+        return resultado
+
+
+class ZabbixAsync(Zabbix):
+    """
+    Motor asyncio (aiohttp) con lotes JSON-RPC 2.0: varias llamadas viajan
+    en un mismo POST, cada una con su id, y las respuestas se emparejan por
+    id. Expone los mismos métodos que Zabbix y devuelve las mismas
+    estructuras; las fases que admiten paralelismo (resolución, últimos
+    valores y series) se envían como lotes concurrentes.
+    """
+
+    def __init__(self, url, token, workers=1, max_solicitudes=None, cache=None, metadatos=None,
+                 timeout=60, reintentos=REINTENTOS_MAX, llamadas_por_post=LLAMADAS_POR_POST):
+        if aiohttp is None:
+            raise SystemExit("[!] El motor async requiere aiohttp (pip install aiohttp)")
+
+        super().__init__(url, token, workers, max_solicitudes, cache, metadatos, timeout, reintentos)
+        self.llamadas_por_post = max(1, llamadas_por_post)
+        self._loop = asyncio.new_event_loop()
+        self._sesion_async = None
+        self._cupo_async = None
+
+    def cerrar(self):
+        if self._sesion_async is not None:
+            self._loop.run_until_complete(self._sesion_async.close())
+        self._loop.close()
+        super().cerrar()
+
+    def _ejecutar(self, corrutina):
+        return self._loop.run_until_complete(corrutina)
+
+    async def _entrar(self):
+        async with self._cupo_async:
+            await self._cupo_async.wait_for(self.limitador.intentar_entrar)
+
+    async def _salir(self, method, segundos, bajada=0, sobrecarga=False):
+        self.limitador.salir(method, segundos, bajada, sobrecarga)
+        async with self._cupo_async:
+            self._cupo_async.notify_all()
+
+    async def _post_lote(self, llamadas):
+        """
+        Un POST con varias llamadas, con reintentos ante timeouts, 429 y 5xx.
+        Si el lote no entra en la memoria del frontend se parte en dos; una
+        llamada sola que tampoco entra devuelve un ErrorMemoria en su lugar.
+        """
+        if self._sesion_async is None:
+            self._sesion_async = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limite, ssl=False),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._cupo_async = asyncio.Condition()
+
+        pedidos = [
+            {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params,
+                "auth": self.token,
+                "id": self.nuevo_id(),
+            }
+            for method, params in llamadas
+        ]
+        partes = [json.dumps(pedido).encode("utf-8") for pedido in pedidos]
+        cuerpo = b"[" + b",".join(partes) + b"]"
+        # Los lotes suelen ser de un solo método: el límite AIMD usa el primero
+        metodo = pedidos[0]["method"]
+        error = None
+
+        for intento in range(self.reintentos + 1):
+            if intento:
+                for pedido in pedidos[1:]:
+                    self.instrumentacion.reintento(pedido["method"])
+                await asyncio.sleep(self.esperar_reintento(metodo, intento, error))
+
+            await self._entrar()
+            inicio = time.perf_counter()
+            try:
+                async with self._sesion_async.post(
+                    self.url,
+                    data=cuerpo,
+                    headers={"Content-Type": "application/json"},
+                ) as r:
+                    contenido = await r.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                segundos = time.perf_counter() - inicio
+                await self._salir(metodo, segundos, sobrecarga=True)
+                for pedido, parte in zip(pedidos, partes):
+                    self.instrumentacion.registrar(pedido["method"], segundos, len(parte), error=True)
+                error = e
+                continue
+
+            segundos = time.perf_counter() - inicio
+            memoria = r.status >= 400 and es_error_memoria(contenido)
+            sobrecarga = not memoria and (r.status == 429 or r.status >= 500)
+            await self._salir(metodo, segundos, len(contenido), sobrecarga)
+
+            self.bytes_subida += len(cuerpo)
+            self.bytes_bajada += len(contenido)
+
+            if r.status >= 400:
+                for pedido, parte in zip(pedidos, partes):
+                    self.instrumentacion.registrar(
+                        pedido["method"], segundos, len(parte), len(contenido) // len(pedidos), error=True
+                    )
+                if memoria:
+                    if len(llamadas) == 1:
+                        return [ErrorMemoria(contenido[:300].decode("utf-8", "replace"))]
+                    mitad = len(llamadas) // 2
+                    self.instrumentacion.particion(metodo)
+                    primera, segunda = await asyncio.gather(
+                        self._post_lote(llamadas[:mitad]), self._post_lote(llamadas[mitad:])
+                    )
+                    return primera + segunda
+                if sobrecarga:
+                    error = aiohttp.ClientResponseError(r.request_info, r.history, status=r.status, message=r.reason)
+                    continue
+                r.raise_for_status()
+
+            return self._respuestas_lote(pedidos, partes, contenido, segundos)
+
+        raise error
+
+    def _respuestas_lote(self, pedidos, partes, contenido, segundos):
+        data = json.loads(contenido)
+        if isinstance(data, dict):
+            data = [data]
+        respuestas = {x.get("id"): x for x in data}
+
+        # Cada llamada del lote lleva la latencia del POST; la bajada se
+        # reparte según las filas devueltas (los lotes suelen ser de un
+        # solo método, así el total por método es exacto).
+        respuestas = [respuestas.get(p["id"], {"error": "sin respuesta en el lote"}) for p in pedidos]
+        filas = [len(x.get("result") or []) + 1 for x in respuestas]
+        total_filas = sum(filas)
+
+        resultados = []
+        for pedido, parte, respuesta, peso in zip(pedidos, partes, respuestas, filas):
+            self.instrumentacion.registrar(
+                pedido["method"],
+                segundos,
+                len(parte),
+                len(contenido) * peso // total_filas,
+                error="error" in respuesta,
+            )
+            if "error" in respuesta and es_error_memoria(respuesta["error"]):
+                resultados.append(ErrorMemoria(respuesta["error"]))
+            elif "error" in respuesta:
+                self.error_api(pedido["method"], pedido["params"], respuesta["error"])
+                resultados.append([])
+            else:
+                resultados.append(respuesta.get("result", []))
+
+        return resultados
+
+    async def api_lote(self, llamadas, partir=True, por_post=None):
+        """
+        Ejecuta [(method, params), ...] en POSTs concurrentes de por_post
+        llamadas (por defecto llamadas_por_post). Con partir=True una llamada
+        que no entra en memoria se parte (partir_params); si no, su
+        ErrorMemoria queda en el resultado para que lo resuelva quien llama.
+        """
+        partes = await asyncio.gather(*(
+            self._post_lote(parte) for parte in lotes(llamadas, por_post or self.llamadas_por_post)
+        ))
+        resultados = [resultado for parte in partes for resultado in parte]
+
+        if partir:
+            for indice, ((method, params), resultado) in enumerate(zip(llamadas, resultados)):
+                if not isinstance(resultado, ErrorMemoria):
+                    continue
+
+                mitades = partir_params(params)
+                if not mitades:
+                    self.error_api(method, params, resultado)
+                    resultados[indice] = []
+                    continue
+
+                self.instrumentacion.particion(method)
+                sub = await self.api_lote([(method, p) for p in mitades])
+                resultados[indice] = [fila for filas in sub for fila in filas]
+
+        return resultados
+
+    def api(self, method, params):
+        return self._ejecutar(self.api_lote([(method, params)]))[0]
+
+    def buscar_hosts(self, objetivos):
+        # Los tres filtros viajan en un solo POST; la prioridad se aplica aquí
+        objetivos = list(dict.fromkeys(objetivos))
+        campos = ("ip", "name", "host")
+        resultados = self._ejecutar(self.api_lote([
+            ("host.get", params_host(campo, objetivos)) for campo in campos
+        ]))
+
+        encontrados = {}
+        for campo, hosts in zip(campos, resultados):
+            mapa = mapa_hosts(campo, hosts)
+            for objetivo in objetivos:
+                if objetivo not in encontrados and objetivo in mapa:
+                    encontrados[objetivo] = mapa[objetivo]
+
+        return encontrados
+
+    def hosts_selectores(self, selectores):
+        # hostgroup.get va primero (hacen falta los groupids); los host.get
+        # de todos los selectores viajan en un solo POST
+        params = params_selectores(selectores, self.ids_grupos(selectores))
+        resultados = self._ejecutar(self.api_lote([("host.get", p) for p in params.values()]))
+        return {k: v for k, v in zip(params, resultados) if v}
+
+    def consultar_macros(self, ids):
+        # Los del host/plantillas y los globales en un solo POST
+        return tuple(self._ejecutar(self.api_lote(params_macros(ids))))
+
+    def ultimos_valores(self, items):
+        resultado = {}
+        ahora = int(time.time())
+        pendientes = agrupar_por_tipo(items)
+
+        for ventana in VENTANAS_ULTIMO:
+            llamadas = [
+                ("history.get", params_ultimo(value_type, lote, ahora - ventana))
+                for value_type, itemids in pendientes.items()
+                for lote in lotes(list(dict.fromkeys(itemids)), ITEMS_POR_LOTE)
+            ]
+            if not llamadas:
+                break
+
+            for filas in self._ejecutar(self.api_lote(llamadas)):
+                for fila in filas:
+                    resultado.setdefault(fila["itemid"], [fila])
+
+            pendientes = {
+                value_type: [x for x in itemids if x not in resultado]
+                for value_type, itemids in pendientes.items()
+            }
+            pendientes = {k: v for k, v in pendientes.items() if v}
+
+        sueltos = [(itemid, value_type) for value_type, itemids in pendientes.items() for itemid in itemids]
+        respuestas = self._ejecutar(self.api_lote([
+            ("history.get", {
+                "output": ["clock", "value"],
+                "itemids": [itemid],
+                "history": value_type,
+                "sortfield": "clock",
+                "sortorder": "DESC",
+                "limit": 1,
+            })
+            for itemid, value_type in sueltos
+        ]))
+        for (itemid, _), filas in zip(sueltos, respuestas):
+            resultado[itemid] = filas
+
+        return resultado
+
+    def _series_api(self, items, inicio, fin, usar_trends):
+        # Cada ronda pide una página de las tareas activas en lotes JSON-RPC
+        # repartidos entre los POSTs permitidos. Solo avanzan las tareas de
+        # una ventana desde la primera sin entregar, y cada una con menos de
+        # PAGINAS_EN_COLA páginas por entregar: la memoria no depende del
+        # largo del rango. Una tarea que no entra en la memoria del frontend
+        # se reemplaza por sus mitades (partir_tarea), que corren en orden.
+        tareas = self.tareas_series(items, inicio, fin, usar_trends)
+        pendientes = [[tarea] for tarea in tareas]
+        recibidas = [[] for _ in tareas]
+        ventana = max(self.limite, self.workers) * PAGINAS_EN_COLA
+        siguiente = 0
+
+        while siguiente < len(tareas):
+            activas = [
+                indice for indice in range(siguiente, min(len(tareas), siguiente + ventana))
+                if pendientes[indice] and len(recibidas[indice]) < PAGINAS_EN_COLA
+            ]
+            respuestas = self._ejecutar(self.api_lote(
+                [(pendientes[i][0][0], params_serie(pendientes[i][0])) for i in activas],
+                partir=False,
+                por_post=min(self.llamadas_por_post, -(-len(activas) // self.limite)),
+            ))
+
+            for indice, filas in zip(activas, respuestas):
+                tarea = pendientes[indice].pop(0)
+
+                if isinstance(filas, ErrorMemoria):
+                    mitades = partir_tarea(tarea)
+                    if mitades:
+                        self.instrumentacion.particion(tarea[0])
+                        pendientes[indice][:0] = mitades
+                    else:
+                        self.error_api(tarea[0], params_serie(tarea), filas)
+                    continue
+
+                completas, tarea_siguiente = avanzar_pagina(tarea, filas)
+                recibidas[indice].append(completas)
+                if tarea_siguiente:
+                    pendientes[indice].insert(0, tarea_siguiente)
+
+            # Se entrega en orden todo lo que ya se puede entregar (tareas
+            # cerradas y lo recibido de la primera abierta).
+            while siguiente < len(tareas):
+                for filas in recibidas[siguiente]:
+                    yield from repartir_filas(filas)
+                recibidas[siguiente] = []
+                if pendientes[siguiente]:
+                    break
+                siguiente += 1
+
 
 def normalizar(texto):
     return " ".join(str(texto).lower().strip().split())
 
 
-def seleccionar_item(items, metrica):
+TIPOS_METRICA = ("estatica", "utilizacion")
+
+
+def compilar_metrica(metrica):
+    """Copia de la métrica con los nombres ya normalizados (una vez por corrida, no por host)."""
+    return dict(
+        metrica,
+        preferidos_norm=tuple(normalizar(x) for x in metrica.get("preferidos", [])),
+        buscar_norm=tuple(normalizar(x) for x in metrica["buscar"]),
+    )
+
+
+def cargar_catalogo(ruta=None):
     """
-    Selecciona primero por nombre exacto/preferido.
-    Si no encuentra, usa coincidencia parcial.
-    Esto ayuda a que las IPs adicionales tomen el mismo item que se ve en Zabbix.
+    METRICAS más las de un catálogo JSON o YAML: una lista (o {"metricas":
+    [...]}) de {reporte, tipo, buscar, preferidos}. Una entrada con el mismo
+    "reporte" que una predeterminada la reemplaza; el resto se agrega al final.
+    Devuelve las métricas compiladas (ver compilar_metrica).
     """
-    preferidos = [normalizar(x) for x in metrica["preferidos"]]
-    buscar = [normalizar(x) for x in metrica["buscar"]]
+    metricas = {m["reporte"]: m for m in METRICAS}
+
+    if ruta:
+        with open(ruta, encoding="utf-8") as fh:
+            if ruta.endswith((".yml", ".yaml")):
+                if yaml is None:
+                    raise SystemExit("[!] Falta PyYAML para leer el catálogo; use JSON o instálelo")
+                catalogo = yaml.safe_load(fh)
+            else:
+                catalogo = json.load(fh)
 
-    # 1. Nombre exacto
-    for esperado in preferidos:
-        for item in items:
-            if normalizar(item.get("name", "")) == esperado:
-                return item
+        if isinstance(catalogo, dict):
+            catalogo = catalogo.get("metricas")
+        if not isinstance(catalogo, list):
+            raise SystemExit(f"[!] {ruta}: el catálogo debe ser una lista de métricas")
 
-    # 2. Nombre que termine igual
-    for esperado in preferidos:
-        for item in items:
-            if normalizar(item.get("name", "")).endswith(esperado):
-                return item
+        for n, metrica in enumerate(catalogo, 1):
+            if not isinstance(metrica, dict) or not metrica.get("reporte"):
+                raise SystemExit(f"[!] {ruta}: la métrica {n} no tiene 'reporte'")
+            if metrica.get("tipo") not in TIPOS_METRICA:
+                raise SystemExit(f"[!] {ruta}: {metrica['reporte']}: tipo debe ser {' o '.join(TIPOS_METRICA)}")
+            if isinstance(metrica.get("buscar"), str):
+                metrica["buscar"] = [metrica["buscar"]]
+            if not metrica.get("buscar"):
+                raise SystemExit(f"[!] {ruta}: {metrica['reporte']}: falta 'buscar'")
+            metrica.setdefault("preferidos", [])
+            metricas[metrica["reporte"]] = metrica
 
-    # 3. Coincidencia parcial
-    for item in items:
-        nombre = normalizar(item.get("name", ""))
-        if any(x in nombre for x in buscar):
-            return item
+    return [compilar_metrica(m) for m in metricas.values()]
 
-    return None
+
+class IndiceItems:
+    """
+    Índice de los items de un host con los nombres normalizados una sola
+    vez: nombre exacto y sufijos en diccionarios (O(1) por nombre
+    preferido) y la primera coincidencia parcial de cada término guardada
+    al buscarla, así cada término se recorre una vez por host aunque lo
+    compartan varias métricas. Ante empates gana el primer item en el
+    orden de la API, igual que la búsqueda lineal.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.nombres = [normalizar(item.get("name", "")) for item in items]
+        self.exactos = {}
+        self.sufijos = {}
+        self.parciales = {}
+
+        for posicion, nombre in enumerate(self.nombres):
+            self.exactos.setdefault(nombre, posicion)
+            for corte in range(len(nombre)):
+                self.sufijos.setdefault(nombre[corte:], posicion)
+
+    def parcial(self, termino):
+        if termino not in self.parciales:
+            self.parciales[termino] = next(
+                (posicion for posicion, nombre in enumerate(self.nombres) if termino in nombre),
+                None,
+            )
+        return self.parciales[termino]
+
+    def seleccionar(self, metrica):
+        """
+        Selecciona primero por nombre exacto/preferido.
+        Si no encuentra, usa coincidencia parcial.
+        Esto ayuda a que las IPs adicionales tomen el mismo item que se ve en Zabbix.
+        """
+        if "preferidos_norm" not in metrica:
+            metrica = compilar_metrica(metrica)
+
+        # 1. Nombre exacto
+        for esperado in metrica["preferidos_norm"]:
+            if esperado in self.exactos:
+                return self.items[self.exactos[esperado]]
+
+        # 2. Nombre que termine igual
+        for esperado in metrica["preferidos_norm"]:
+            if esperado in self.sufijos:
+                return self.items[self.sufijos[esperado]]
+
+        # 3. Coincidencia parcial
+        posiciones = [self.parcial(x) for x in metrica["buscar_norm"]]
+        posiciones = [x for x in posiciones if x is not None]
+        return self.items[min(posiciones)] if posiciones else None
 
 
 def to_float(valor):
@@ -213,46 +1775,1003 @@ def resumir_ultimo(puntos):
     }
 
 
-def resumir_serie(puntos, usar_trends):
-    if not puntos:
-        return {"avg": None, "max": None, "min": None, "ultimo": None, "puntos": 0}
+def numero_zabbix(texto):
+    """"90", "1.5", "10M", "5m" -> float con el sufijo de Zabbix aplicado; None si no es número."""
+    texto = (texto or "").strip()
+    multiplicador = SUFIJOS_ZABBIX.get(texto[-1:])
+    numero = to_float(texto[:-1] if multiplicador else texto)
+    return numero * (multiplicador or 1) if numero is not None else None
+
+
+@functools.lru_cache(maxsize=4096)
+def parsear_umbral(expresion):
+    """
+    (operador, texto del umbral) de la primera comparación de la expresión
+    de un trigger, o None. Memorizado: las expresiones de una misma
+    plantilla se repiten en toda la flota.
+    """
+    match = PATRON_UMBRAL.search(expresion or "")
+    return (match.group(1), match.group(2)) if match else None
+
+
+def nombre_macro(macro):
+    """'{$CPU.UTIL.CRIT:"prod"}' -> '{$CPU.UTIL.CRIT}' (sin contexto)."""
+    return macro.split(":", 1)[0].rstrip("}") + "}"
+
+
+def resolver_macro(macro, macros):
+    """
+    Valor de un macro con los macros efectivos del host; uno con contexto
+    sin definir para ese contexto toma el valor del macro sin contexto,
+    como en Zabbix.
+    """
+    if macro in macros:
+        return macros[macro]
+    return macros.get(nombre_macro(macro))
+
 
-    if usar_trends:
-        avgs = [to_float(p.get("value_avg")) for p in puntos]
-        maxs = [to_float(p.get("value_max")) for p in puntos]
-        mins = [to_float(p.get("value_min")) for p in puntos]
+def umbrales_triggers(triggers, macros):
+    """
+    Modelo estructurado de los umbrales de un item: una entrada por
+    trigger con operador, texto del umbral tal como está en la expresión
+    y valor numérico (None si es un macro sin resolver o no hay
+    comparación).
+    """
+    umbrales = []
+
+    for trigger in triggers:
+        operador, texto = parsear_umbral(trigger.get("expression", "")) or (None, None)
+        if texto and texto.startswith("{$"):
+            valor = numero_zabbix(resolver_macro(texto, macros))
+        else:
+            valor = numero_zabbix(texto)
+
+        umbrales.append({
+            "trigger": trigger.get("description", ""),
+            "operador": operador,
+            "texto": texto,
+            "valor": valor,
+        })
 
-        avgs = [x for x in avgs if x is not None]
-        maxs = [x for x in maxs if x is not None]
-        mins = [x for x in mins if x is not None]
+    return umbrales
 
-        promedio = sum(avgs) / len(avgs) if avgs else None
+
+class SketchCuantiles:
+    """
+    Sketch de cuantiles combinable (estilo DDSketch): cada valor cae en un
+    bucket logarítmico con error relativo SKETCH_ALPHA. La memoria está
+    acotada por SKETCH_MAX_BUCKETS y dos sketches se combinan sumando
+    conteos, así los percentiles por host se pueden unir por grupo sin
+    volver a pedir las series.
+    """
+
+    def __init__(self, alpha=SKETCH_ALPHA):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.ceros = 0
+        self.buckets = {}
+        self.total = 0
+
+    def agregar(self, valor, peso=1):
+        """peso: cuántas muestras representa el valor (p. ej. "num" de una hora de trend)."""
+        self.total += peso
+        if valor <= 1e-9:
+            self.ceros += peso
+            return
+
+        indice = math.ceil(math.log(valor) / self.log_gamma)
+        self.buckets[indice] = self.buckets.get(indice, 0) + peso
+
+        if len(self.buckets) > SKETCH_MAX_BUCKETS:
+            # Se pliegan los buckets más bajos: el error queda en la cola baja
+            orden = sorted(self.buckets)
+            sobrantes = orden[:len(orden) - SKETCH_MAX_BUCKETS]
+            destino = orden[len(sobrantes)]
+            for indice in sobrantes:
+                self.buckets[destino] += self.buckets.pop(indice)
+
+    def combinar(self, otro):
+        self.total += otro.total
+        self.ceros += otro.ceros
+        for indice, conteo in otro.buckets.items():
+            self.buckets[indice] = self.buckets.get(indice, 0) + conteo
+
+    def cuantil(self, q):
+        if not self.total:
+            return None
+
+        rango = q * (self.total - 1)
+        acumulado = self.ceros
+        if acumulado > rango:
+            return 0.0
+
+        for indice in sorted(self.buckets):
+            acumulado += self.buckets[indice]
+            if acumulado > rango:
+                return 2 * self.gamma ** indice / (self.gamma + 1)
+
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def a_dict(self):
+        indices = sorted(self.buckets)
+        return {
+            "alpha": self.alpha,
+            "ceros": self.ceros,
+            "indices": indices,
+            "conteos": [self.buckets[i] for i in indices],
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        sketch = cls(datos.get("alpha", SKETCH_ALPHA))
+        sketch.ceros = datos.get("ceros", 0)
+        sketch.buckets = dict(zip(datos.get("indices", []), datos.get("conteos", [])))
+        sketch.total = sketch.ceros + sum(sketch.buckets.values())
+        return sketch
+
+
+class RollupTiempo:
+    """
+    Rollups compactos de una serie: promedio y máximo por hora del día, por
+    día del rango y por horario laboral / no laboral. Cada bloque de filas se
+    reparte en buckets con NumPy (bincount / maximum.at), sin recorrer
+    diccionarios por fila.
+    """
+
+    def __init__(self, inicio, fin):
+        # Desfase de la hora local al inicio del rango (para horas y días locales)
+        self.desfase = int(datetime.fromtimestamp(inicio).astimezone().utcoffset().total_seconds())
+        self.inicio_dia = (inicio + self.desfase) // 86400 * 86400 - self.desfase
+        self.dias = max(1, (fin - self.inicio_dia) // 86400 + 1)
+
+        self.suma_hora = np.zeros(24)
+        self.peso_hora = np.zeros(24)
+        self.max_hora = np.full(24, -np.inf)
+        self.suma_dia = np.zeros(self.dias)
+        self.peso_dia = np.zeros(self.dias)
+        self.max_dia = np.full(self.dias, -np.inf)
+        self.suma_laboral = np.zeros(2)
+        self.peso_laboral = np.zeros(2)
+        self.max_laboral = np.full(2, -np.inf)
+
+    def agregar(self, clocks, valores, maximos, pesos):
+        if not clocks:
+            return
+
+        clocks = np.asarray(clocks, dtype=np.int64)
+        valores = np.asarray(valores, dtype=float)
+        maximos = np.asarray(maximos, dtype=float)
+        pesos = np.asarray(pesos, dtype=float)
+
+        local = clocks + self.desfase
+        hora = (local // 3600) % 24
+        dia = np.clip((clocks - self.inicio_dia) // 86400, 0, self.dias - 1)
+        # 1970-01-01 fue jueves: (días + 3) % 7 deja lunes = 0
+        semana = (local // 86400 + 3) % 7
+        laboral = ((semana < 5) & (hora >= HORARIO_LABORAL[0]) & (hora < HORARIO_LABORAL[1])).astype(np.int64)
+
+        for indice, suma, peso, maximo, tamano in (
+            (hora, self.suma_hora, self.peso_hora, self.max_hora, 24),
+            (dia, self.suma_dia, self.peso_dia, self.max_dia, self.dias),
+            (laboral, self.suma_laboral, self.peso_laboral, self.max_laboral, 2),
+        ):
+            suma += np.bincount(indice, weights=valores * pesos, minlength=tamano)
+            peso += np.bincount(indice, weights=pesos, minlength=tamano)
+            np.maximum.at(maximo, indice, maximos)
+
+    @staticmethod
+    def _lista(suma, peso, maximo):
+        promedio = np.divide(suma, peso, out=np.full_like(suma, np.nan), where=peso > 0)
+        return (
+            [round(float(x), 4) if not np.isnan(x) else None for x in promedio],
+            [round(float(x), 4) if np.isfinite(x) else None for x in maximo],
+        )
+
+    def a_dict(self):
+        avg_hora, max_hora = self._lista(self.suma_hora, self.peso_hora, self.max_hora)
+        avg_dia, max_dia = self._lista(self.suma_dia, self.peso_dia, self.max_dia)
+        avg_lab, max_lab = self._lista(self.suma_laboral, self.peso_laboral, self.max_laboral)
+
+        return {
+            "hora_dia": {"avg": avg_hora, "max": max_hora},
+            "dia": {
+                "fechas": [
+                    datetime.fromtimestamp(self.inicio_dia + i * 86400 + 43200).strftime("%Y-%m-%d")
+                    for i in range(self.dias)
+                ],
+                "avg": avg_dia,
+                "max": max_dia,
+            },
+            "laboral": {"avg": avg_lab[1], "max": max_lab[1]},
+            "no_laboral": {"avg": avg_lab[0], "max": max_lab[0]},
+        }
+
+
+class AgregadoSerie:
+    """
+    Resumen incremental de una serie: suma, cuenta, mínimo, máximo y último
+    valor. Se alimenta por bloques de filas a medida que llegan de la API,
+    así la memoria por item es O(1) sin importar la longitud del rango.
+    Los percentiles salen de un SketchCuantiles (con tendencias, sobre los
+    promedios horarios) y, si se pasa un RollupTiempo, los rollups se
+    calculan en la misma pasada. Lo mismo con los umbrales (ver
+    umbrales_triggers): se cuenta el peso de las muestras que cumplen la
+    condición de cada trigger.
+    """
+
+    def __init__(self, usar_trends, ponderar=False, rollup=None, umbrales=None):
+        self.usar_trends = usar_trends
+        self.ponderar = ponderar
+        self.rollup = rollup
+        self.umbrales = umbrales or []
+        self.comparaciones = [
+            (indice, COMPARADORES[u["operador"]], u["valor"])
+            for indice, u in enumerate(self.umbrales)
+            if u["operador"] and u["valor"] is not None
+        ]
+        self.en_umbral = [0] * len(self.umbrales)
+        self.puntos = 0
+        self.suma = 0
+        self.cuenta = 0
+        self.maximo = None
+        self.minimo = None
+        self.ultimo = None
+        self.sketch = SketchCuantiles()
+
+    def agregar(self, filas, usar_trends=None):
+        """
+        usar_trends indica el tipo de filas (por defecto el del agregado). Con
+        ponderar=True cada hora de trend pesa su "num" de muestras, para que
+        el promedio y los percentiles combinen bien con filas de history
+        (modo híbrido).
+        """
+        tendencias = self.usar_trends if usar_trends is None else usar_trends
+        clocks, valores, maximos, pesos = [], [], [], []
+
+        for p in filas:
+            self.puntos += 1
+            peso = 1
+
+            if tendencias:
+                avg = to_float(p.get("value_avg"))
+                maximo = to_float(p.get("value_max"))
+                minimo = to_float(p.get("value_min"))
+                if self.ponderar:
+                    peso = int(to_float(p.get("num")) or 1)
+            else:
+                avg = maximo = minimo = to_float(p.get("value"))
+
+            if avg is not None:
+                self.suma += avg * peso
+                self.cuenta += peso
+                self.ultimo = avg
+                self.sketch.agregar(avg, peso)
+
+                for indice, comparar, limite in self.comparaciones:
+                    if comparar(avg, limite):
+                        self.en_umbral[indice] += peso
+
+                if self.rollup is not None:
+                    clocks.append(int(p["clock"]))
+                    valores.append(avg)
+                    maximos.append(maximo if maximo is not None else avg)
+                    pesos.append(peso)
+
+            if maximo is not None and (self.maximo is None or maximo > self.maximo):
+                self.maximo = maximo
+
+            if minimo is not None and (self.minimo is None or minimo < self.minimo):
+                self.minimo = minimo
+
+        if self.rollup is not None:
+            self.rollup.agregar(clocks, valores, maximos, pesos)
+
+    def resumen(self):
+        if not self.puntos:
+            return {
+                "avg": None, "max": None, "min": None, "ultimo": None, "puntos": 0,
+                **self.percentiles(),
+            }
+
+        promedio = self.suma / self.cuenta if self.cuenta else None
 
         return {
             "avg": round(promedio, 4) if promedio is not None else None,
-            "max": round(max(maxs), 4) if maxs else None,
-            "min": round(min(mins), 4) if mins else None,
-            "ultimo": round(avgs[-1], 4) if avgs else None,
-            "puntos": len(puntos),
+            "max": round(self.maximo, 4) if self.maximo is not None else None,
+            "min": round(self.minimo, 4) if self.minimo is not None else None,
+            "ultimo": round(self.ultimo, 4) if self.ultimo is not None else None,
+            "puntos": self.puntos,
+            **self.percentiles(),
         }
 
-    valores = [to_float(p.get("value")) for p in puntos]
-    valores = [x for x in valores if x is not None]
+    def tiempo_umbrales(self, segundos):
+        """
+        Los umbrales con el tiempo que la serie estuvo del lado del trigger
+        (valor <operador> umbral): % de las muestras, ponderadas como el
+        promedio (con tendencias, el promedio de cada hora), y su estimado
+        en segundos sobre un rango de esa duración.
+        """
+        resultado = []
+        for indice, umbral in enumerate(self.umbrales):
+            fraccion = None
+            if self.cuenta and umbral["operador"] and umbral["valor"] is not None:
+                fraccion = self.en_umbral[indice] / self.cuenta
+            resultado.append({
+                **umbral,
+                "pct_tiempo": round(fraccion * 100, 4) if fraccion is not None else None,
+                "segundos": int(round(fraccion * segundos)) if fraccion is not None else None,
+            })
+        return resultado
+
+    def percentiles(self):
+        resultado = {}
+        for nombre, q in PERCENTILES:
+            valor = self.sketch.cuantil(q)
+            resultado[nombre] = round(valor, 4) if valor is not None else None
+        return resultado
+
 
-    if not valores:
-        return {"avg": None, "max": None, "min": None, "ultimo": None, "puntos": len(puntos)}
+def valor_metrica(maquina, reporte, campo):
+    """Campo de "datos" de una métrica de la máquina, o None si no está."""
+    for metrica in maquina.get("metricas", []):
+        if metrica.get("nombre_reporte") == reporte:
+            return to_float(metrica.get("datos", {}).get(campo))
+    return None
 
-    promedio = sum(valores) / len(valores)
+
+class AgregadoGrupos:
+    """
+    Estadísticas por grupo de aplicación acumuladas a medida que terminan
+    las máquinas, sin segunda pasada: hosts, núcleos y memoria sumados,
+    % CPU ponderado por núcleos y % RAM ponderado por memoria, p95 de los
+    máximos por host (sketch) y los top_n hosts con mayor p95 de CPU. Un
+    host pedido por dos objetivos del mismo grupo cuenta una vez; uno sin
+    núcleos (o memoria) conocidos queda fuera de ese promedio y se cuenta
+    en cpu_hosts_sin_peso (ram_hosts_sin_peso).
+    """
+
+    def __init__(self, top_n=TOP_HOSTS_GRUPO):
+        self.top_n = top_n
+        self.grupos = {}
+
+    def agregar(self, maquina):
+        grupo = self.grupos.setdefault(maquina.get("grupo", ""), {
+            "hostids": set(),
+            "nucleos": 0,
+            "memoria": 0,
+            "cpu": [0.0, 0.0, 0],
+            "ram": [0.0, 0.0, 0],
+            "max_cpu": SketchCuantiles(),
+            "max_ram": SketchCuantiles(),
+            "tope": {"cpu": None, "ram": None},
+            "top": [],
+        })
+        hostid = maquina.get("hostid") or maquina.get("objetivo")
+        if hostid in grupo["hostids"]:
+            return
+        grupo["hostids"].add(hostid)
+
+        nucleos = valor_metrica(maquina, "Number of CPUs/Cores", "ultimo")
+        memoria = valor_metrica(maquina, "Total memory", "ultimo")
+        grupo["nucleos"] += nucleos or 0
+        grupo["memoria"] += memoria or 0
+
+        # Sin núcleos o memoria conocidos no hay peso comparable (un 1 frente
+        # a bytes no contaría nada): el host sale del promedio y se cuenta aparte.
+        for clave, reporte, peso in (
+            ("cpu", "CPU utilization", nucleos),
+            ("ram", "Memory utilization", memoria),
+        ):
+            avg = valor_metrica(maquina, reporte, "avg")
+            maximo = valor_metrica(maquina, reporte, "max")
+            if avg is not None and peso:
+                grupo[clave][0] += avg * peso
+                grupo[clave][1] += peso
+            elif avg is not None:
+                grupo[clave][2] += 1
+            if maximo is not None:
+                grupo["max_" + clave].agregar(maximo)
+                grupo["tope"][clave] = max(maximo, grupo["tope"][clave] or maximo)
+
+        p95 = valor_metrica(maquina, "CPU utilization", "p95")
+        if p95 is None:
+            p95 = valor_metrica(maquina, "CPU utilization", "avg")
+        if p95 is not None and self.top_n:
+            entrada = (p95, -len(grupo["hostids"]), {
+                "objetivo": maquina.get("objetivo", ""),
+                "nombre_maquina": maquina.get("nombre_maquina", ""),
+                "cpu_p95": p95,
+                "cpu_max": valor_metrica(maquina, "CPU utilization", "max"),
+                "ram_p95": valor_metrica(maquina, "Memory utilization", "p95"),
+            })
+            if len(grupo["top"]) < self.top_n:
+                heapq.heappush(grupo["top"], entrada)
+            else:
+                heapq.heappushpop(grupo["top"], entrada)
+
+    def a_dict(self):
+        redondear = lambda v: round(v, 4) if v is not None else None
+        resultado = {}
+
+        def p95_maximos(grupo, clave):
+            # El bucket del sketch puede quedar apenas por encima del mayor máximo real
+            valor = grupo["max_" + clave].cuantil(0.95)
+            return min(valor, grupo["tope"][clave]) if valor is not None else None
+
+        for nombre, grupo in self.grupos.items():
+            resultado[nombre] = {
+                "hosts": len(grupo["hostids"]),
+                "nucleos": int(grupo["nucleos"]),
+                "memoria_bytes": int(grupo["memoria"]),
+                "cpu_promedio_ponderado": redondear(grupo["cpu"][0] / grupo["cpu"][1]) if grupo["cpu"][1] else None,
+                "ram_promedio_ponderado": redondear(grupo["ram"][0] / grupo["ram"][1]) if grupo["ram"][1] else None,
+                "cpu_hosts_sin_peso": grupo["cpu"][2],
+                "ram_hosts_sin_peso": grupo["ram"][2],
+                "cpu_p95_maximos": redondear(p95_maximos(grupo, "cpu")),
+                "ram_p95_maximos": redondear(p95_maximos(grupo, "ram")),
+                "top_hosts": [x[2] for x in sorted(grupo["top"], reverse=True)],
+            }
+
+        return resultado
+
+
+def leer_ndjson(ruta):
+    """
+    Genera (inicio, fin, registro) de cada línea completa y válida del
+    NDJSON, con sus offsets. Se detiene en la primera línea cortada o
+    inválida (un corte a mitad de escritura).
+    """
+    with open(ruta, "rb") as fh:
+        while True:
+            inicio = fh.tell()
+            linea = fh.readline()
+            if not linea.endswith(b"\n"):
+                break
+            try:
+                registro = json.loads(linea)
+            except ValueError:
+                break
+            yield inicio, fh.tell(), registro
+
+
+class SalidaNdjson:
+    """
+    Salida incremental: una línea "cabecera" con el rango, una "maquina"
+    por host a medida que se completa su bloque y una "ejecucion" con el
+    tráfico y el rendimiento al final de cada corrida. Solo se agregan
+    líneas, así un corte conserva todo lo escrito hasta el último bloque.
+    Con reanudar=True se sigue el archivo existente y los objetivos ya
+    escritos quedan en hechos; previas (si se pasa) recibe cada máquina
+    ya escrita, para retomar los agregados sin releer el archivo.
+    """
+
+    def __init__(self, ruta, cabecera, reanudar=False, previas=None):
+        self.ruta = ruta
+        self.hechos = set()
+
+        if reanudar and os.path.exists(ruta):
+            previa = None
+            fin_valido = 0
+            for _, fin_valido, registro in leer_ndjson(ruta):
+                if registro.get("tipo") == "cabecera":
+                    previa = registro
+                elif registro.get("tipo") == "maquina":
+                    self.hechos.add(registro["objetivo"])
+                    if previas is not None:
+                        previas(registro["maquina"])
+
+            campos = ("inicio", "fin", "fuente", "comparar_periodos", "shard")
+            if previa is None or any(previa["rango"].get(c) != cabecera["rango"].get(c) for c in campos):
+                raise SystemExit(f"[!] {ruta} no corresponde al mismo rango/fuente; no se puede reanudar")
+
+            # Se descarta una posible línea a medio escribir antes de seguir
+            with open(ruta, "r+b") as fh:
+                fh.truncate(fin_valido)
+            self.fh = open(ruta, "a", encoding="utf-8")
+            return
+
+        self.fh = open(ruta, "w", encoding="utf-8")
+        self._linea(cabecera)
+
+    def _linea(self, registro):
+        self.fh.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+    def escribir(self, maquinas):
+        for maquina in maquinas:
+            self._linea({"tipo": "maquina", "objetivo": maquina["objetivo"], "maquina": maquina})
+            self.hechos.add(maquina["objetivo"])
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+
+    def cerrar(self, trafico, rendimiento, grupos=None):
+        self._linea({"tipo": "ejecucion", "trafico": trafico, "rendimiento": rendimiento, "grupos": grupos or {}})
+        self.fh.close()
+
+
+class MaquinasNdjson:
+    """
+    Las máquinas de un NDJSON en el orden de objetivos (la última línea de
+    cada objetivo gana). Solo guarda offsets: se iteran leyendo del archivo.
+    """
+
+    def __init__(self, ruta, offsets, orden):
+        self.ruta = ruta
+        self.offsets = offsets
+        self.orden = [o for o in orden if o in offsets]
+
+    def __len__(self):
+        return len(self.orden)
+
+    def __iter__(self):
+        with open(self.ruta, "rb") as fh:
+            for objetivo in self.orden:
+                fh.seek(self.offsets[objetivo])
+                yield json.loads(fh.readline())["maquina"]
+
+
+def payload_desde_ndjson(ruta, objetivos=None, grupos=None):
+    """
+    Finalizador: arma el payload con la forma de siempre (.json/.json.gz)
+    desde el NDJSON. El tráfico suma todas las corridas (reanudaciones
+    incluidas) y el rendimiento es el de la última. grupos es el
+    AgregadoGrupos.a_dict() ya calculado durante la extracción.
+    """
+    cabecera = {}
+    offsets = {}
+    trafico = {"subida_bytes": 0, "bajada_bytes": 0}
+    rendimiento = {}
+
+    for offset, _, registro in leer_ndjson(ruta):
+        tipo = registro.get("tipo")
+        if tipo == "cabecera":
+            cabecera = registro
+        elif tipo == "maquina":
+            offsets.pop(registro["objetivo"], None)
+            offsets[registro["objetivo"]] = offset
+        elif tipo == "ejecucion":
+            for clave in trafico:
+                trafico[clave] += registro.get("trafico", {}).get(clave, 0)
+            rendimiento = registro.get("rendimiento", {})
 
     return {
-        "avg": round(promedio, 4),
-        "max": round(max(valores), 4),
-        "min": round(min(valores), 4),
-        "ultimo": round(valores[-1], 4),
-        "puntos": len(puntos),
+        "generado": cabecera.get("generado"),
+        "rango": cabecera.get("rango", {}),
+        "trafico": trafico,
+        "grupos": grupos or {},
+        "maquinas": MaquinasNdjson(ruta, offsets, objetivos if objetivos is not None else list(offsets)),
+        "rendimiento": rendimiento,
     }
 
 
+def columna_float(filas, campo):
+    """Un campo de las filas como float64; lo que no es número queda en NaN."""
+    try:
+        # numpy convierte los textos de la API directamente
+        return np.array([p[campo] for p in filas], dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        return np.array([to_float(p.get(campo)) for p in filas], dtype=np.float64)
+
+
+class SeriesCrudas:
+    """
+    Todos los puntos consultados (history: clock/valor; trend: clock y
+    avg/min/max/num) en un archivo columnar escrito a medida que llegan los
+    bloques. itemid, hostid, grupo y metrica van codificados como
+    diccionario: códigos int32 por fila más la lista de valores distintos.
+
+    - .parquet (pyarrow): un row group comprimido con zstd cada
+      FILAS_POR_GRUPO filas; se lee con pyarrow.parquet.read_table(...,
+      memory_map=True) o pandas.read_parquet.
+    - .npz (solo numpy): cada columna se acumula en un binario temporal y
+      al cerrar se pasa por partes a un .npz comprimido (<col>_valores
+      trae el diccionario); np.load lee solo las columnas que se pidan.
+    """
+
+    COLUMNAS = [
+        ("clock", np.int64),
+        ("valor", np.float64),
+        ("minimo", np.float64),
+        ("maximo", np.float64),
+        ("num", np.int32),
+        ("tendencia", np.uint8),
+    ]
+    DICCIONARIOS = ["itemid", "hostid", "grupo", "metrica"]
+    FILAS_POR_GRUPO = 200000
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.parquet = ruta.endswith(".parquet")
+        if self.parquet and pq is None:
+            raise SystemExit("[!] Falta pyarrow para escribir .parquet; instálelo o use una ruta .npz")
+
+        self.codigos = {c: {} for c in self.DICCIONARIOS}
+        # Items ya escritos: un host que vuelve en otro bloque no se repite
+        self.itemids = set()
+        self.bloques = []
+        self.en_memoria = 0
+        self.filas = 0
+        self.escritor = None
+
+        if not self.parquet:
+            self.temporal = ruta + ".tmp"
+            os.makedirs(self.temporal, exist_ok=True)
+            self.partes = {
+                c: open(os.path.join(self.temporal, c), "wb")
+                for c, _ in self.COLUMNAS
+            }
+            self.partes.update({
+                c: open(os.path.join(self.temporal, c), "wb")
+                for c in self.DICCIONARIOS
+            })
+
+    def agregar(self, filas, tendencias, etiquetas):
+        """filas de history.get/trend.get de un item; etiquetas: columna -> texto."""
+        n = len(filas)
+        if not n:
+            return
+
+        if tendencias:
+            valor = columna_float(filas, "value_avg")
+            minimo = columna_float(filas, "value_min")
+            maximo = columna_float(filas, "value_max")
+            num = np.nan_to_num(columna_float(filas, "num")).astype(np.int32)
+        else:
+            valor = columna_float(filas, "value")
+            minimo = maximo = valor
+            num = np.ones(n, dtype=np.int32)
+
+        bloque = {
+            "clock": columna_float(filas, "clock").astype(np.int64),
+            "valor": valor,
+            "minimo": minimo,
+            "maximo": maximo,
+            "num": num,
+            "tendencia": np.full(n, int(bool(tendencias)), dtype=np.uint8),
+        }
+        for columna in self.DICCIONARIOS:
+            codigos = self.codigos[columna]
+            codigo = codigos.setdefault(str(etiquetas.get(columna, "")), len(codigos))
+            bloque[columna] = np.full(n, codigo, dtype=np.int32)
+
+        self.bloques.append(bloque)
+        self.en_memoria += n
+        if self.en_memoria >= self.FILAS_POR_GRUPO:
+            self.volcar()
+
+    def volcar(self):
+        if not self.bloques:
+            return
+
+        columnas = {
+            c: np.concatenate([b[c] for b in self.bloques])
+            for c in self.bloques[0]
+        }
+        self.filas += self.en_memoria
+        self.bloques = []
+        self.en_memoria = 0
+
+        if not self.parquet:
+            for c, valores in columnas.items():
+                self.partes[c].write(valores.tobytes())
+            return
+
+        arreglos = [pa.array(columnas[c]) for c, _ in self.COLUMNAS]
+        arreglos += [
+            pa.DictionaryArray.from_arrays(pa.array(columnas[c]), pa.array(list(self.codigos[c]), pa.string()))
+            for c in self.DICCIONARIOS
+        ]
+        tabla = pa.Table.from_arrays(arreglos, names=[c for c, _ in self.COLUMNAS] + self.DICCIONARIOS)
+
+        if self.escritor is None:
+            self.escritor = pq.ParquetWriter(self.ruta, tabla.schema, compression="zstd")
+        self.escritor.write_table(tabla, row_group_size=len(tabla))
+
+    def cerrar(self):
+        self.volcar()
+
+        if self.parquet:
+            if self.escritor is None:
+                # Sin puntos: archivo vacío pero con el esquema completo
+                campos = [pa.field(c, pa.from_numpy_dtype(t)) for c, t in self.COLUMNAS]
+                campos += [pa.field(c, pa.dictionary(pa.int32(), pa.string())) for c in self.DICCIONARIOS]
+                self.escritor = pq.ParquetWriter(self.ruta, pa.schema(campos), compression="zstd")
+            self.escritor.close()
+            return
+
+        tipos = dict(self.COLUMNAS, **{c: np.int32 for c in self.DICCIONARIOS})
+        with zipfile.ZipFile(self.ruta, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for c, fh in self.partes.items():
+                fh.close()
+                # memmap: la columna pasa al zip por partes, sin cargarla entera
+                valores = (
+                    np.memmap(fh.name, dtype=tipos[c], mode="r")
+                    if self.filas else np.empty(0, dtype=tipos[c])
+                )
+                with zf.open(c + ".npy", "w", force_zip64=True) as destino:
+                    np.lib.format.write_array(destino, valores)
+                del valores
+
+            for c in self.DICCIONARIOS:
+                with zf.open(c + "_valores.npy", "w") as destino:
+                    np.lib.format.write_array(destino, np.array(list(self.codigos[c]), dtype=str))
+
+        shutil.rmtree(self.temporal, ignore_errors=True)
+
+
+def volcar_json(fh, payload, indent=None):
+    """
+    Escribe payload como objeto JSON clave por clave. Un valor invocable se
+    evalúa recién al llegar a su clave (datos que cambian mientras se
+    escribe) y un iterable que no es lista (p. ej. MaquinasNdjson) se
+    escribe como arreglo elemento por elemento, sin cargarlo entero.
+    """
+    salto = "\n" + " " * indent if indent else ""
+    fh.write("{")
+    for n, (clave, valor) in enumerate(payload.items()):
+        if callable(valor):
+            valor = valor()
+        fh.write(("," if n else "") + (salto or (" " if n else "")))
+        fh.write(f"{json.dumps(clave, ensure_ascii=False)}: ")
+
+        if isinstance(valor, (dict, list, tuple, str)) or not hasattr(valor, "__iter__"):
+            fh.write(json.dumps(valor, ensure_ascii=False, indent=indent).replace("\n", salto or "\n"))
+            continue
+
+        interno = salto + " " * indent if indent else ""
+        fh.write("[")
+        vacio = True
+        for elemento in valor:
+            texto = json.dumps(elemento, ensure_ascii=False, indent=indent).replace("\n", interno or "\n")
+            fh.write(("" if vacio else ",") + (interno or ("" if vacio else " ")) + texto)
+            vacio = False
+        fh.write(("" if vacio or not indent else salto) + "]")
+    fh.write("\n}" if indent else "}")
+
+
+def extraer_bloque(zbx, objetivos, mapa_grupos, terminos, tramos, ponderar=False, crudas=None, ventanas=None,
+                   metricas=None, resueltos=None):
+    """
+    Resuelve, consulta y resume un bloque de objetivos; devuelve sus
+    máquinas en el orden de entrada. Los tramos son los de main()
+    (desde, hasta, usar_trends) y ponderar va a AgregadoSerie. Con crudas
+    (SeriesCrudas) cada bloque de filas se guarda además tal como llegó.
+    Con varias ventanas (ventanas_comparacion) los tramos las cubren a
+    todas: el resumen principal es el de la última y cada métrica de
+    utilización trae además "periodos" con el resumen y el delta de cada una.
+    metricas es el catálogo de cargar_catalogo (por defecto METRICAS).
+    resueltos ({objetivo: host}, de expandir_selectores) se usa tal cual y
+    solo el resto de los objetivos pasa por buscar_hosts.
+    """
+    fase = zbx.instrumentacion.fase
+    usar_trends = any(t for _, _, t in tramos)
+    ventanas = ventanas or [(tramos[0][0], tramos[-1][1])]
+    metricas = metricas or [compilar_metrica(m) for m in METRICAS]
+    metodo_series = "+".join(dict.fromkeys("trend.get" if t else "history.get" for _, _, t in tramos))
+    maquinas = []
+
+    with fase("resolucion"):
+        resueltos = resueltos or {}
+        hosts = {x: resueltos[x] for x in objetivos if x in resueltos}
+        faltantes = [x for x in objetivos if x not in hosts]
+        if faltantes:
+            hosts.update(zbx.con_metadatos("host", faltantes, zbx.buscar_hosts))
+
+    with fase("metadatos"):
+        # Metadatos en bloque: un item.get, un trigger.get y un usermacro.get
+        # para toda la flota.
+        # La clave de items incluye los términos buscados: si cambian, se renueva.
+        hostids = list(dict.fromkeys(h["hostid"] for h in hosts.values()))
+        items_por_host = zbx.con_metadatos(
+            "items:" + hashlib.sha1("|".join(sorted(terminos)).encode("utf-8")).hexdigest()[:8],
+            hostids,
+            lambda faltantes: zbx.obtener_items_hosts(faltantes, terminos),
+        )
+
+        seleccion = {}
+        for hostid, items in items_por_host.items():
+            indice = IndiceItems(items)
+            seleccion[hostid] = [(m, indice.seleccionar(m)) for m in metricas]
+
+        itemids_util = [
+            item["itemid"]
+            for elegidos in seleccion.values()
+            for metrica, item in elegidos
+            if item and metrica["tipo"] == "utilizacion"
+        ]
+        triggers_por_item = zbx.con_metadatos("triggers", itemids_util, zbx.triggers_items)
+
+        # Umbrales de los triggers: los macros de usuario que usan se
+        # resuelven en bloque para los hosts que los necesitan.
+        usados = set()
+        hosts_macros = []
+        for hostid, elegidos in seleccion.items():
+            for metrica, item in elegidos:
+                if not item or metrica["tipo"] != "utilizacion":
+                    continue
+                for trigger in triggers_por_item.get(item["itemid"], []):
+                    _, texto = parsear_umbral(trigger.get("expression", "")) or (None, None)
+                    if texto and texto.startswith("{$"):
+                        usados.add(nombre_macro(texto))
+                        hosts_macros.append(hostid)
+
+        macros = {}
+        if usados:
+            macros = zbx.con_metadatos(
+                "macros:" + hashlib.sha1("|".join(sorted(usados)).encode("utf-8")).hexdigest()[:8],
+                hosts_macros,
+                lambda faltantes: zbx.macros_hosts(faltantes, usados),
+            )
+
+        umbrales_por_item = {
+            item["itemid"]: umbrales_triggers(triggers_por_item.get(item["itemid"], []), macros.get(hostid, {}))
+            for hostid, elegidos in seleccion.items()
+            for metrica, item in elegidos
+            if item and metrica["tipo"] == "utilizacion"
+        }
+
+    # Series en bloque: pocos history.get/trend.get para todos los items
+    items_estaticos = []
+    items_util = []
+    for elegidos in seleccion.values():
+        for metrica, item in elegidos:
+            if item:
+                (items_estaticos if metrica["tipo"] == "estatica" else items_util).append(item)
+
+    # Etiquetas de las series crudas; un host pedido por dos objetivos queda
+    # con el grupo del primero, también si el otro cae en un bloque anterior
+    # (sus items ya están en crudas.itemids y no se escriben de nuevo).
+    etiquetas = {}
+    if crudas is not None:
+        grupo_host = {}
+        for objetivo in objetivos:
+            if objetivo in hosts:
+                grupo_host.setdefault(hosts[objetivo]["hostid"], mapa_grupos.get(objetivo, "SIN GRUPO ASIGNADO"))
+        etiquetas = {
+            item["itemid"]: {
+                "itemid": item["itemid"],
+                "hostid": hostid,
+                "grupo": grupo_host.get(hostid, "SIN GRUPO ASIGNADO"),
+                "metrica": metrica["reporte"],
+            }
+            for hostid, elegidos in seleccion.items()
+            for metrica, item in elegidos
+            if item and item["itemid"] not in crudas.itemids
+        }
+        crudas.itemids.update(etiquetas)
+
+    with fase("series"):
+        ultimos = zbx.ultimos_valores(items_estaticos)
+        if crudas is not None:
+            for itemid, filas in ultimos.items():
+                if itemid in etiquetas:
+                    crudas.agregar(filas, False, etiquetas[itemid])
+
+        # Cada bloque de filas se agrega al vuelo; no se guardan las series
+        # (en modo híbrido los tramos van en orden: borde inicial, medio, borde final)
+        # Con comparación de períodos la última ventana es el agregado de
+        # siempre (con rollups); las anteriores solo llevan el resumen.
+        agregados = {
+            item["itemid"]: AgregadoSerie(
+                usar_trends,
+                ponderar=ponderar,
+                rollup=RollupTiempo(*ventanas[-1]),
+                umbrales=umbrales_por_item.get(item["itemid"]),
+            )
+            for item in items_util
+        }
+        previos = {
+            itemid: [AgregadoSerie(usar_trends, ponderar=ponderar) for _ in ventanas[:-1]]
+            for itemid in agregados
+        } if len(ventanas) > 1 else {}
+
+        for desde, hasta, tramo_trends in tramos:
+            for itemid, filas in zbx.series_rango(items_util, desde, hasta, tramo_trends):
+                if itemid in agregados:
+                    *anteriores, actuales = partir_ventanas(filas, ventanas)
+                    agregados[itemid].agregar(actuales, tramo_trends)
+                    for agregado, parte in zip(previos.get(itemid, []), anteriores):
+                        agregado.agregar(parte, tramo_trends)
+                    if itemid in etiquetas:
+                        crudas.agregar(filas, tramo_trends, etiquetas[itemid])
+
+    # Un item guardado que ya no devuelve datos puede haber sido borrado en
+    # Zabbix: se invalida para que la próxima ejecución lo vuelva a resolver.
+    if zbx.metadatos is not None:
+        sin_datos = [
+            i["itemid"] for i in items_estaticos + items_util
+            if not ultimos.get(i["itemid"]) and not (i["itemid"] in agregados and agregados[i["itemid"]].puntos)
+        ]
+        zbx.metadatos.invalidar_items(sin_datos)
+
+    with fase("armado"):
+        for objetivo in objetivos:
+            grupo = mapa_grupos.get(objetivo, "SIN GRUPO ASIGNADO")
+
+            host = hosts.get(objetivo)
+            if not host:
+                print(f"[!] No se encontró host: {objetivo}", file=sys.stderr)
+                continue
+
+            print(f"[host] {objetivo} -> {host['name']} | grupo={grupo}")
+
+            metricas_host = []
+
+            for metrica, item in seleccion.get(host["hostid"], []):
+                if not item:
+                    print(f"  [!] No se encontró item: {metrica['reporte']}", file=sys.stderr)
+                    continue
+
+                if metrica["tipo"] == "estatica":
+                    metodo = "history.get"
+                    datos = resumir_ultimo(ultimos.get(item["itemid"], []))
+                    sketch = None
+                    rollups = None
+                    usa_trend_metrica = False
+                    periodos = None
+                    umbrales = []
+                else:
+                    metodo = metodo_series
+                    datos = agregados[item["itemid"]].resumen()
+                    sketch = agregados[item["itemid"]].sketch.a_dict()
+                    rollups = agregados[item["itemid"]].rollup.a_dict()
+                    usa_trend_metrica = usar_trends
+                    periodos = None
+                    umbrales = agregados[item["itemid"]].tiempo_umbrales(ventanas[-1][1] - ventanas[-1][0])
+
+                    if item["itemid"] in previos:
+                        resumenes = [a.resumen() for a in previos[item["itemid"]]] + [datos]
+                        periodos = [
+                            {
+                                "inicio": datetime.fromtimestamp(desde).strftime("%Y-%m-%d %H:%M:%S"),
+                                "fin": datetime.fromtimestamp(hasta).strftime("%Y-%m-%d %H:%M:%S"),
+                                "datos": resumen,
+                                "delta": deltas_periodo(resumen, resumenes[k - 1]) if k else None,
+                            }
+                            for k, ((desde, hasta), resumen) in enumerate(zip(ventanas, resumenes))
+                        ]
+
+                triggers = triggers_por_item.get(item["itemid"], []) if metrica["tipo"] == "utilizacion" else []
+
+                metricas_host.append({
+                    "nombre_reporte": metrica["reporte"],
+                    "item_name": item.get("name", ""),
+                    "itemid": item.get("itemid", ""),
+                    "key_": item.get("key_", ""),
+                    "units": item.get("units", ""),
+                    "value_type": item.get("value_type", ""),
+                    "metodo_usado": metodo,
+                    "usar_tendencias": usa_trend_metrica,
+                    "datos": datos,
+                    "sketch": sketch,
+                    "rollups": rollups,
+                    "triggers": triggers,
+                    "umbrales": umbrales,
+                })
+                if periodos is not None:
+                    metricas_host[-1]["periodos"] = periodos
+
+                print(
+                    f"  [item] {metrica['reporte']} -> "
+                    f"{item.get('name', '')} | "
+                    f"key={item.get('key_', '')} | "
+                    f"metodo={metodo} | "
+                    f"avg={datos.get('avg')} | "
+                    f"max={datos.get('max')} | "
+                    f"p95={datos.get('p95')}"
+                )
+
+            maquinas.append({
+                "objetivo": objetivo,
+                "nombre_maquina": host.get("name", ""),
+                "hostid": host.get("hostid", ""),
+                "grupo": grupo,
+                "metricas": metricas_host,
+            })
+
+    return maquinas
+
+
 def grupo_por_objetivo(grupos):
     mapa = {}
     for grupo, objetivos in grupos.items():
@@ -261,14 +2780,290 @@ def grupo_por_objetivo(grupos):
     return mapa
 
 
+def expandir_selectores(zbx, objetivos, mapa_grupos):
+    """
+    Reemplaza cada selector (grupo:/tag:) por sus hosts, identificados por el
+    nombre técnico, en el lugar del selector y con su grupo de aplicación
+    (mapa_grupos se completa aquí). Devuelve (objetivos, {objetivo: host})
+    con esos hosts ya resueltos; un host de dos selectores queda con el primero.
+    """
+    selectores = [x for x in objetivos if es_selector(x)]
+    if not selectores:
+        return objetivos, {}
+
+    por_selector = zbx.con_metadatos("selectores", selectores, zbx.hosts_selectores)
+    expandidos = []
+    resueltos = {}
+
+    for objetivo in objetivos:
+        if not es_selector(objetivo):
+            expandidos.append(objetivo)
+            continue
+
+        hosts = por_selector.get(objetivo, [])
+        if not hosts:
+            print(f"[!] El selector {objetivo} no devolvió hosts", file=sys.stderr)
+            continue
+
+        for host in hosts:
+            if host["host"] in resueltos:
+                continue
+            resueltos[host["host"]] = host
+            expandidos.append(host["host"])
+            mapa_grupos.setdefault(host["host"], mapa_grupos.get(objetivo, "SIN GRUPO ASIGNADO"))
+        print(f"[selector] {objetivo}: {len(hosts)} hosts")
+
+    return list(dict.fromkeys(expandidos)), resueltos
+
+
+def shard_de(objetivo, total):
+    """Shard (0..total-1) de un objetivo por hash estable: no depende del orden ni de PYTHONHASHSEED."""
+    return int.from_bytes(hashlib.sha1(objetivo.encode("utf-8")).digest()[:8], "big") % total
+
+
+def parsear_shard(texto):
+    """'i/N' con 1 <= i <= N -> (i, N)."""
+    try:
+        indice, total = (int(x) for x in texto.split("/"))
+    except ValueError:
+        indice = total = 0
+    if not 1 <= indice <= total:
+        print(f"[!] --shard debe ser i/N con 1 <= i <= N (recibido: {texto})", file=sys.stderr)
+        sys.exit(2)
+    return indice, total
+
+
+def cargar_parcial(ruta):
+    """
+    Payload de una salida del extractor. De un .ndjson las máquinas se leen
+    perezosamente (MaquinasNdjson); un .json o .json.gz se carga entero.
+    """
+    if ruta.endswith(".ndjson"):
+        return payload_desde_ndjson(ruta)
+
+    abrir = gzip.open if ruta.endswith(".gz") else open
+    with abrir(ruta, "rt", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def combinar_rendimiento(rendimientos):
+    """
+    Rendimiento de varios shards: contadores y bytes sumados; latencias y
+    fases con el máximo (los shards corren en paralelo, así que el tiempo
+    de pared es el del más lento).
+    """
+    metodos = {}
+    fases = {}
+
+    for rendimiento in rendimientos:
+        for metodo, datos in rendimiento.get("metodos", {}).items():
+            destino = metodos.setdefault(metodo, {"latencia_ms": {}})
+            for clave, v in datos.items():
+                if clave == "latencia_ms":
+                    for q, ms in v.items():
+                        previo = destino["latencia_ms"].get(q)
+                        destino["latencia_ms"][q] = ms if previo is None or (ms or 0) > previo else previo
+                else:
+                    destino[clave] = destino.get(clave, 0) + (v or 0)
+
+        for nombre, segundos in rendimiento.get("fases_segundos", {}).items():
+            fases[nombre] = max(fases.get(nombre, 0), segundos)
+
+    return {"metodos": metodos, "fases_segundos": fases}
+
+
+class MaquinasCombinadas:
+    """
+    Mezcla ordenada (por posición en los objetivos de entrada) de las
+    máquinas de varios shards, cada una ya en ese orden. Se puede recorrer
+    varias veces; un objetivo repetido entre shards sale una sola vez.
+    """
+
+    def __init__(self, fuentes, posicion):
+        self.fuentes = fuentes
+        self.posicion = posicion
+        self.total = None
+
+    def __len__(self):
+        if self.total is None:
+            self.total = sum(1 for _ in self)
+        return self.total
+
+    def __iter__(self):
+        vistos = set()
+        clave = lambda m: self.posicion.get(m.get("objetivo"), len(self.posicion))
+        for maquina in heapq.merge(*self.fuentes, key=clave):
+            if maquina.get("objetivo") not in vistos:
+                vistos.add(maquina.get("objetivo"))
+                yield maquina
+        self.total = len(vistos)
+
+
+def combinar_shards(rutas, top_n=TOP_HOSTS_GRUPO):
+    """
+    Une las salidas de varios shards (--shard i/N) en un solo payload: las
+    máquinas vuelven al orden de entrada con una mezcla ordenada de las de
+    cada shard (que ya vienen en ese orden), el tráfico se suma y los
+    grupos se recalculan sobre el resultado. "maquinas" es un
+    MaquinasCombinadas que se recorre una vez para los grupos y otra al
+    escribir. Solo las entradas .ndjson se leen en streaming: las de un
+    .json/.json.gz quedan enteras en memoria (ver cargar_parcial).
+    """
+    parciales = [cargar_parcial(ruta) for ruta in rutas]
+    rango = dict(parciales[0].get("rango", {}))
+    shard = rango.pop("shard", None)
+
+    campos = ("inicio", "fin", "fuente", "comparar_periodos")
+    indices = []
+    for ruta, parcial in zip(rutas, parciales):
+        otro = parcial.get("rango", {})
+        if any(otro.get(c) != rango.get(c) for c in campos):
+            raise SystemExit(f"[!] {ruta} no corresponde al mismo rango/fuente que {rutas[0]}")
+        if shard is not None:
+            propio = otro.get("shard") or {}
+            if propio.get("total") != shard["total"] or propio.get("objetivos") != shard["objetivos"]:
+                raise SystemExit(f"[!] {ruta} no es un shard de la misma extracción que {rutas[0]}")
+            indices.append(propio["indice"])
+
+    if shard is not None:
+        repetidos = sorted({i for i in indices if indices.count(i) > 1})
+        if repetidos:
+            raise SystemExit(f"[!] Shards repetidos: {', '.join(map(str, repetidos))}")
+        faltantes = sorted(set(range(1, shard["total"] + 1)) - set(indices))
+        if faltantes:
+            print(f"[!] Faltan los shards {', '.join(map(str, faltantes))} de {shard['total']}", file=sys.stderr)
+        objetivos = shard["objetivos"]
+    else:
+        objetivos = list(dict.fromkeys(m["objetivo"] for p in parciales for m in p.get("maquinas", [])))
+
+    posicion = {objetivo: n for n, objetivo in enumerate(objetivos)}
+    for parcial in parciales:
+        maquinas = parcial.get("maquinas", [])
+        if isinstance(maquinas, MaquinasNdjson):
+            parcial["maquinas"] = MaquinasNdjson(maquinas.ruta, maquinas.offsets, objetivos)
+        else:
+            parcial["maquinas"] = sorted(maquinas, key=lambda m: posicion.get(m.get("objetivo"), len(posicion)))
+
+    maquinas = MaquinasCombinadas([p["maquinas"] for p in parciales], posicion)
+    grupos = AgregadoGrupos(top_n)
+    for maquina in maquinas:
+        grupos.agregar(maquina)
+
+    trafico = {"subida_bytes": 0, "bajada_bytes": 0}
+    for parcial in parciales:
+        for clave in trafico:
+            trafico[clave] += parcial.get("trafico", {}).get(clave, 0)
+
+    if shard is not None:
+        rango["shards"] = shard["total"]
+
+    return {
+        "generado": datetime.now().isoformat(),
+        "rango": rango,
+        "trafico": trafico,
+        "grupos": grupos.a_dict(),
+        "maquinas": maquinas,
+        "rendimiento": combinar_rendimiento(p.get("rendimiento", {}) for p in parciales),
+    }
+
+
+def escribir_payload(payload, salida, solo_gzip=False):
+    """Escribe <salida>.json (salvo solo_gzip) y <salida>.json.gz; devuelve sus rutas."""
+    ruta_json = f"{salida}.json"
+    ruta_gz = f"{salida}.json.gz"
+
+    if not solo_gzip:
+        with open(ruta_json, "w", encoding="utf-8") as fh:
+            volcar_json(fh, payload, indent=2)
+        print(f"JSON puro: {ruta_json}")
+
+    with gzip.open(ruta_gz, "wt", encoding="utf-8") as fh:
+        volcar_json(fh, payload)
+
+    return (None if solo_gzip else ruta_json), ruta_gz
+
+
+def main_combinar(argv):
+    parser = argparse.ArgumentParser(
+        prog="extraer_zabbix.py merge",
+        description="Une las salidas de los shards (--shard i/N) en un solo .json/.json.gz",
+    )
+    parser.add_argument("entradas", nargs="+", help="Salidas de cada shard (.json, .json.gz o .ndjson)")
+    parser.add_argument("--salida", required=True)
+    parser.add_argument("--solo-gzip", action="store_true")
+    parser.add_argument("--top-hosts", type=int, default=TOP_HOSTS_GRUPO,
+                        help="Hosts con mayor p95 de CPU que se listan por grupo")
+    args = parser.parse_args(argv)
+
+    payload = combinar_shards(args.entradas, args.top_hosts)
+    _, ruta_gz = escribir_payload(payload, args.salida, args.solo_gzip)
+
+    print(f"JSON gzip: {ruta_gz}")
+    print(f"Máquinas procesadas: {len(payload['maquinas'])}")
+    print(f"Tráfico subida: {payload['trafico']['subida_bytes'] / (1024 ** 2):.2f} MB")
+    print(f"Tráfico bajada: {payload['trafico']['bajada_bytes'] / (1024 ** 2):.2f} MB")
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "merge":
+        main_combinar(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser()
-    parser.add_argument("--objetivos", required=True)
+    parser.add_argument("--objetivos", required=True,
+                        help="IPs, nombres o selectores grupo:<grupo de Zabbix> / "
+                             "tag:<etiqueta>[=<valor>], separados por coma")
     parser.add_argument("--grupos-json", required=True)
     parser.add_argument("--fecha-inicio", required=True)
     parser.add_argument("--fecha-fin", required=True)
     parser.add_argument("--salida", required=True)
     parser.add_argument("--solo-gzip", action="store_true")
+    parser.add_argument("--fuente", choices=["auto", "hibrido", "trend", "history"], default="auto",
+                        help="auto = trend.get si el rango pasa de 3 días; hibrido = trend.get "
+                             "para las horas completas y history.get para los bordes")
+    parser.add_argument("--motor", choices=["requests", "async"], default="requests",
+                        help="requests = una llamada por POST (hilos con --workers); "
+                             "async = aiohttp + lotes JSON-RPC")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Hilos para las consultas de series (1 = secuencial)")
+    parser.add_argument("--max-solicitudes", type=int, default=None,
+                        help="Máximo de solicitudes simultáneas a la API (por defecto = --workers); "
+                             "el límite real se adapta (AIMD) si la API se satura")
+    parser.add_argument("--ndjson", action="store_true",
+                        help="Escribir <salida>.ndjson con un registro por host a medida que se "
+                             "completa; al final se genera el .json.gz de siempre")
+    parser.add_argument("--bloque-hosts", type=int, default=None,
+                        help="Objetivos por bloque de extracción (por defecto 200 con --ndjson, "
+                             "todos juntos sin él)")
+    parser.add_argument("--reanudar", "--resume", action="store_true",
+                        help="Seguir un <salida>.ndjson parcial saltando los objetivos ya escritos "
+                             "(implica --ndjson)")
+    parser.add_argument("--catalogo-metricas", default=None,
+                        help="JSON o YAML con métricas adicionales (o que reemplazan a las "
+                             "predeterminadas con el mismo 'reporte')")
+    parser.add_argument("--comparar-periodos", type=int, default=1,
+                        help="Comparar el rango con las N-1 ventanas anteriores del mismo largo "
+                             "(una sola consulta ampliada; 1 = sin comparación)")
+    parser.add_argument("--series-crudas", "--raw-series", default=None,
+                        help="Guardar todos los puntos consultados en un archivo columnar: "
+                             ".parquet (requiere pyarrow) o .npz (solo numpy)")
+    parser.add_argument("--top-hosts", type=int, default=TOP_HOSTS_GRUPO,
+                        help="Hosts con mayor p95 de CPU que se listan por grupo")
+    parser.add_argument("--shard", default=None,
+                        help="i/N: extraer solo los objetivos de este shard (hash estable); "
+                             "las salidas se unen con 'extraer_zabbix.py merge'")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="Segundos de espera por solicitud antes de reintentar")
+    parser.add_argument("--reintentos", type=int, default=REINTENTOS_MAX,
+                        help="Reintentos ante timeouts, 429 y 5xx (espera exponencial con jitter)")
+    parser.add_argument("--cache-metadatos", default=None,
+                        help="Archivo SQLite para guardar host/items/triggers entre ejecuciones")
+    parser.add_argument("--ttl-metadatos", type=int, default=86400,
+                        help="Segundos que un metadato guardado se considera vigente")
+    parser.add_argument("--refrescar-metadatos", "--refresh-metadata", action="store_true",
+                        help="Ignorar la caché de metadatos y volver a consultarlos")
+    parser.add_argument("--cache-tendencias", default=None,
+                        help="Archivo SQLite para reutilizar las horas de trend.get ya descargadas")
     args = parser.parse_args()
 
     url = os.getenv("ZABBIX_URL")
@@ -284,111 +3079,172 @@ def main():
     ts_inicio = int(datetime.strptime(args.fecha_inicio, "%Y-%m-%d %H:%M:%S").timestamp())
     ts_fin = int(datetime.strptime(args.fecha_fin, "%Y-%m-%d %H:%M:%S").timestamp())
 
-    usar_trends = (ts_fin - ts_inicio) / 86400 > 3
+    if args.comparar_periodos < 1:
+        print("[!] --comparar-periodos debe ser 1 o mayor", file=sys.stderr)
+        sys.exit(2)
 
-    objetivos = [x.strip() for x in args.objetivos.split(",") if x.strip()]
-    objetivos = list(dict.fromkeys(objetivos))
+    # La consulta se amplía una vez hacia atrás para cubrir todas las ventanas
+    ventanas = ventanas_comparacion(ts_inicio, ts_fin, args.comparar_periodos)
+    ts_consulta = ventanas[0][0]
+
+    # Cada ventana usa la fuente que tendría sola: comparar períodos no
+    # cambia el resumen del rango pedido.
+    if args.fuente == "hibrido":
+        tramos = [tramo for desde, hasta in ventanas for tramo in tramos_hibridos(desde, hasta)]
+    else:
+        if args.fuente == "auto":
+            usar_trends = (ts_fin - ts_inicio) / 86400 > 3
+        else:
+            usar_trends = args.fuente == "trend"
+        tramos = [(ts_consulta, ts_fin, usar_trends)]
 
-    terminos = []
-    for metrica in METRICAS:
-        terminos.extend(metrica["buscar"])
+    usar_trends = any(t for _, _, t in tramos)
 
-    zbx = Zabbix(url, token)
+    objetivos = [x.strip() for x in args.objetivos.split(",") if x.strip()]
+    objetivos = list(dict.fromkeys(objetivos))
+    if args.shard:
+        indice, total = parsear_shard(args.shard)
+
+    metricas = cargar_catalogo(args.catalogo_metricas)
+    terminos = list(dict.fromkeys(x for metrica in metricas for x in metrica["buscar"]))
+
+    motor = ZabbixAsync if args.motor == "async" else Zabbix
+    cache = CacheTendencias(args.cache_tendencias) if args.cache_tendencias else None
+    metadatos = (
+        CacheMetadatos(args.cache_metadatos, args.ttl_metadatos, args.refrescar_metadatos)
+        if args.cache_metadatos else None
+    )
+    zbx = motor(
+        url,
+        token,
+        workers=args.workers,
+        max_solicitudes=args.max_solicitudes,
+        cache=cache,
+        metadatos=metadatos,
+        timeout=args.timeout,
+        reintentos=args.reintentos,
+    )
+    fase = zbx.instrumentacion.fase
+
+    # Los selectores se expanden antes de repartir: cada shard ve la misma lista
+    with fase("resolucion"):
+        objetivos, resueltos = expandir_selectores(zbx, objetivos, mapa_grupos)
+
+    shard = None
+    if args.shard:
+        # Todos los objetivos quedan en el rango: merge los usa para restaurar el orden
+        shard = {"indice": indice, "total": total, "objetivos": objetivos}
+        objetivos = [x for x in objetivos if shard_de(x, total) == indice - 1]
+        print(f"[shard] {indice}/{total}: {len(objetivos)} de {len(shard['objetivos'])} objetivos")
+
+    rango = {
+        "inicio": args.fecha_inicio,
+        "fin": args.fecha_fin,
+        "usar_tendencias": usar_trends,
+        "fuente": args.fuente,
+        "tramos": [
+            {"desde": desde, "hasta": hasta, "metodo": "trend.get" if t else "history.get"}
+            for desde, hasta, t in tramos
+        ],
+        "modo_datos": "resumido",
+    }
+    if shard is not None:
+        rango["shard"] = shard
+    if len(ventanas) > 1:
+        rango["comparar_periodos"] = len(ventanas)
+        rango["periodos"] = [
+            {
+                "inicio": datetime.fromtimestamp(desde).strftime("%Y-%m-%d %H:%M:%S"),
+                "fin": datetime.fromtimestamp(hasta).strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            for desde, hasta in ventanas
+        ]
+
+    # Agregados por grupo: se alimentan a medida que termina cada bloque
+    grupos_app = AgregadoGrupos(args.top_hosts)
+    en_objetivos = set(objetivos)
+
+    salida_ndjson = None
+    pendientes = objetivos
+    if args.ndjson or args.reanudar:
+        salida_ndjson = SalidaNdjson(
+            f"{args.salida}.ndjson",
+            {"tipo": "cabecera", "generado": datetime.now().isoformat(), "rango": rango},
+            reanudar=args.reanudar,
+            previas=lambda m: grupos_app.agregar(m) if m.get("objetivo") in en_objetivos else None,
+        )
+        pendientes = [x for x in objetivos if x not in salida_ndjson.hechos]
+        if len(pendientes) < len(objetivos):
+            print(f"[reanudar] {len(objetivos) - len(pendientes)} objetivos ya extraídos, quedan {len(pendientes)}")
+
+    crudas = None
+    if args.series_crudas:
+        crudas = SeriesCrudas(args.series_crudas)
+        if len(pendientes) < len(objetivos):
+            print(f"[!] {args.series_crudas} solo tendrá los objetivos de esta corrida", file=sys.stderr)
+
+    # Por bloques la memoria depende del bloque y no de la flota; con NDJSON
+    # cada bloque terminado queda escrito aunque la corrida se corte después.
+    bloque = args.bloque_hosts if args.bloque_hosts is not None else (200 if salida_ndjson else 0)
     maquinas = []
 
-    for objetivo in objetivos:
-        grupo = mapa_grupos.get(objetivo, "SIN GRUPO ASIGNADO")
+    for parte in lotes(pendientes, bloque or max(1, len(pendientes))):
+        nuevas = extraer_bloque(
+            zbx, parte, mapa_grupos, terminos, tramos, args.fuente == "hibrido", crudas, ventanas, metricas,
+            resueltos,
+        )
+        for maquina in nuevas:
+            grupos_app.agregar(maquina)
 
-        host = zbx.buscar_host(objetivo)
-        if not host:
-            print(f"[!] No se encontró host: {objetivo}", file=sys.stderr)
+        if salida_ndjson is None:
+            maquinas.extend(nuevas)
             continue
 
-        print(f"[host] {objetivo} -> {host['name']} | grupo={grupo}")
-
-        items = zbx.obtener_items(host["hostid"], terminos)
-        metricas_host = []
-
-        for metrica in METRICAS:
-            item = seleccionar_item(items, metrica)
+        with fase("escritura"):
+            salida_ndjson.escribir(nuevas)
+        print(f"[ndjson] {len(salida_ndjson.hechos)}/{len(objetivos)} objetivos escritos")
 
-            if not item:
-                print(f"  [!] No se encontró item: {metrica['reporte']}", file=sys.stderr)
-                continue
+    zbx.cerrar()
 
-            if metrica["tipo"] == "estatica":
-                metodo = "history.get"
-                datos = resumir_ultimo(zbx.ultimo_valor(item))
-                usa_trend_metrica = False
-            else:
-                metodo = "trend.get" if usar_trends else "history.get"
-                crudos = zbx.datos_rango(item, ts_inicio, ts_fin, usar_trends)
-                datos = resumir_serie(crudos, usar_trends)
-                usa_trend_metrica = usar_trends
-
-            triggers = zbx.triggers(item["itemid"]) if metrica["tipo"] == "utilizacion" else []
-
-            metricas_host.append({
-                "nombre_reporte": metrica["reporte"],
-                "item_name": item.get("name", ""),
-                "itemid": item.get("itemid", ""),
-                "key_": item.get("key_", ""),
-                "units": item.get("units", ""),
-                "value_type": item.get("value_type", ""),
-                "metodo_usado": metodo,
-                "usar_tendencias": usa_trend_metrica,
-                "datos": datos,
-                "triggers": triggers,
-            })
+    if crudas is not None:
+        with fase("escritura"):
+            crudas.cerrar()
+        print(f"Series crudas: {crudas.ruta} ({crudas.filas} puntos)")
 
-            print(
-                f"  [item] {metrica['reporte']} -> "
-                f"{item.get('name', '')} | "
-                f"key={item.get('key_', '')} | "
-                f"metodo={metodo} | "
-                f"avg={datos.get('avg')} | "
-                f"max={datos.get('max')}"
-            )
-
-        maquinas.append({
-            "objetivo": objetivo,
-            "nombre_maquina": host.get("name", ""),
-            "hostid": host.get("hostid", ""),
-            "grupo": grupo,
-            "metricas": metricas_host,
-        })
-
-    payload = {
-        "generado": datetime.now().isoformat(),
-        "rango": {
-            "inicio": args.fecha_inicio,
-            "fin": args.fecha_fin,
-            "usar_tendencias": usar_trends,
-            "modo_datos": "resumido",
-        },
-        "trafico": {
-            "subida_bytes": zbx.bytes_subida,
-            "bajada_bytes": zbx.bytes_bajada,
-        },
-        "maquinas": maquinas,
+    trafico = {
+        "subida_bytes": zbx.bytes_subida,
+        "bajada_bytes": zbx.bytes_bajada,
     }
 
-    ruta_json = f"{args.salida}.json"
-    ruta_gz = f"{args.salida}.json.gz"
+    if salida_ndjson is None:
+        payload = {
+            "generado": datetime.now().isoformat(),
+            "rango": rango,
+            "trafico": trafico,
+            "grupos": grupos_app.a_dict(),
+            "maquinas": maquinas,
+        }
+    else:
+        with fase("escritura"):
+            salida_ndjson.cerrar(trafico, zbx.instrumentacion.a_dict(), grupos_app.a_dict())
+        print(f"NDJSON: {salida_ndjson.ruta}")
+        payload = payload_desde_ndjson(salida_ndjson.ruta, objetivos, grupos_app.a_dict())
 
-    if not args.solo_gzip:
-        with open(ruta_json, "w", encoding="utf-8") as fh:
-            json.dump(payload, fh, ensure_ascii=False, indent=2)
-        print(f"JSON puro: {ruta_json}")
+    # "rendimiento" va al final y se evalúa al escribirlo, para que incluya
+    # el tiempo de la propia escritura hasta ese punto.
+    payload["rendimiento"] = zbx.instrumentacion.a_dict
 
-    with gzip.open(ruta_gz, "wt", encoding="utf-8") as fh:
-        json.dump(payload, fh, ensure_ascii=False)
+    with fase("escritura"):
+        _, ruta_gz = escribir_payload(payload, args.salida, args.solo_gzip)
 
     print(f"JSON gzip: {ruta_gz}")
-    print(f"Máquinas procesadas: {len(maquinas)}")
+    print(f"Máquinas procesadas: {len(payload['maquinas'])}")
     print(f"Tráfico subida: {zbx.bytes_subida / (1024 ** 2):.2f} MB")
     print(f"Tráfico bajada: {zbx.bytes_bajada / (1024 ** 2):.2f} MB")
 
+    for nombre, segundos in zbx.instrumentacion.a_dict()["fases_segundos"].items():
+        print(f"[fase] {nombre}: {segundos:.2f} s")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,18 +1,210 @@
 #!/usr/bin/env python3
 
 import argparse
+import functools
 import gzip
+import itertools
 import json
+import math
 import re
+import sys
 from datetime import datetime
 
-import pandas as pd
+import xlsxwriter
+
+# Ancho de columna: largo del texto más largo + 2, entre estos topes.
+ANCHO_MIN = 18
+ANCHO_MAX = 55
+
+# Mismo estilo de encabezado que escribía pandas.
+ESTILO_ENCABEZADO = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+
+# Solo para JSON de extractores anteriores a "umbrales" (traen únicamente
+# "triggers"): el patrón con que este script leía las expresiones. Los
+# umbrales actuales los interpreta extraer_zabbix.py.
+PATRON_UMBRAL_ANTERIOR = re.compile(r"([><=]+)\s*(\d+(?:\.\d+)?|\{\$[^\}]+})")
+
+# Métricas estáticas con columna propia en la hoja principal; las demás
+# (las del catálogo) van a Summary con su último valor.
+ESTATICAS_PRINCIPAL = ("Number of CPUs/Cores", "Total memory")
+
+# Lectura incremental del JSON: caracteres descomprimidos por lectura.
+BLOQUE_LECTURA = 1 << 20
+ESPACIOS = re.compile(r"\s*")
 
 
 def cargar_json(ruta):
     abrir = gzip.open if ruta.endswith(".gz") else open
-    with abrir(ruta, "rt", encoding="utf-8") as f:
-        return json.load(f)
+    if ruta.endswith((".ndjson", ".ndjson.gz")):
+        return cargar_ndjson(ruta, abrir)
+
+    return leer_payload(ruta, abrir)
+
+
+class LectorJson:
+    """
+    Decodificador incremental mínimo: recorre los separadores de objetos y
+    listas a mano y decodifica cada valor con JSONDecoder.raw_decode sobre
+    un búfer que se rellena de a BLOQUE_LECTURA caracteres. En memoria
+    queda solo el valor que se está leyendo.
+    """
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.buf = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _llenar(self):
+        bloque = self.fh.read(BLOQUE_LECTURA)
+        if not bloque:
+            return False
+        self.buf = self.buf[self.pos:] + bloque
+        self.pos = 0
+        return True
+
+    def siguiente(self):
+        """Próximo carácter que no es espacio, sin consumirlo ("" al final del archivo)."""
+        while True:
+            self.pos = ESPACIOS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._llenar():
+                return self.buf[self.pos:self.pos + 1]
+
+    def consumir(self, esperado):
+        encontrado = self.siguiente()
+        if encontrado != esperado:
+            raise ValueError(f"JSON inválido: se esperaba {esperado!r} y vino {encontrado!r}")
+        self.pos += 1
+
+    def valor(self):
+        self.siguiente()
+        while True:
+            try:
+                v, fin = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Valor cortado por el final del búfer
+                if self._llenar():
+                    continue
+                raise
+            # Un número pegado al final del búfer puede seguir en el próximo bloque
+            if fin == len(self.buf) and self._llenar():
+                continue
+            self.pos = fin
+            return v
+
+    def elementos(self, apertura, cierre):
+        """
+        Recorre una lista u objeto: cada iteración deja el lector al inicio
+        de un elemento (que lee quien itera) y después consume la coma o el
+        cierre.
+        """
+        self.consumir(apertura)
+        if self.siguiente() == cierre:
+            self.pos += 1
+            return
+
+        while True:
+            yield
+            if self.siguiente() != ",":
+                self.consumir(cierre)
+                return
+            self.pos += 1
+
+
+def leer_payload(ruta, abrir=open):
+    """
+    Payload de un .json/.json.gz de extraer_zabbix.py sin cargarlo entero.
+    Las claves anteriores a "maquinas" (rango, trafico, grupos) se leen
+    ya; "maquinas" es un iterador de una sola pasada que decodifica una
+    máquina por vez y, al agotarse, agrega al mismo dict las claves que
+    vienen después (rendimiento).
+    """
+    fh = abrir(ruta, "rt", encoding="utf-8")
+    lector = LectorJson(fh)
+    payload = {}
+    claves = lector.elementos("{", "}")
+
+    for _ in claves:
+        clave = lector.valor()
+        lector.consumir(":")
+        if clave == "maquinas":
+            break
+        payload[clave] = lector.valor()
+    else:
+        fh.close()
+        payload.setdefault("maquinas", [])
+        return payload
+
+    def maquinas():
+        with fh:
+            for _ in lector.elementos("[", "]"):
+                yield lector.valor()
+            for _ in claves:
+                clave = lector.valor()
+                lector.consumir(":")
+                payload[clave] = lector.valor()
+
+    payload["maquinas"] = maquinas()
+    return payload
+
+
+class MaquinasNdjson:
+    """
+    Máquinas de un .ndjson en el orden en que aparecieron (gana la última
+    línea de cada objetivo), leídas del archivo por offset al iterar: en
+    memoria queda un offset por objetivo, no las máquinas.
+    """
+
+    def __init__(self, ruta, abrir, offsets):
+        self.ruta = ruta
+        self.abrir = abrir
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        with self.abrir(self.ruta, "rb") as f:
+            for offset in self.offsets.values():
+                f.seek(offset)
+                yield json.loads(f.readline())["maquina"]
+
+
+def cargar_ndjson(ruta, abrir=open):
+    """
+    Lee la salida --ndjson de extraer_zabbix.py (también una parcial):
+    cabecera, una línea por máquina (gana la última de cada objetivo) y
+    una "ejecucion" por corrida (los grupos son los de la última). Una
+    última línea cortada se ignora. Las máquinas se leen recién al
+    recorrerlas (MaquinasNdjson).
+    """
+    payload = {"rango": {}, "trafico": {"subida_bytes": 0, "bajada_bytes": 0}, "grupos": {}, "rendimiento": {}}
+    offsets = {}
+    offset = 0
+
+    with abrir(ruta, "rb") as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+            except ValueError:
+                break
+
+            tipo = registro.get("tipo")
+            if tipo == "cabecera":
+                payload["generado"] = registro.get("generado")
+                payload["rango"] = registro.get("rango", {})
+            elif tipo == "maquina":
+                offsets[registro["objetivo"]] = offset
+            elif tipo == "ejecucion":
+                for clave in payload["trafico"]:
+                    payload["trafico"][clave] += registro.get("trafico", {}).get(clave, 0)
+                payload["rendimiento"] = registro.get("rendimiento", {})
+                payload["grupos"] = registro.get("grupos", {})
+
+            offset += len(linea)
+
+    payload["maquinas"] = MaquinasNdjson(ruta, abrir, offsets)
+    return payload
 
 
 def valor(datos, campo):
@@ -22,33 +214,130 @@ def valor(datos, campo):
         return None
 
 
+def formato_numero(decimales, sufijo="", signo=False):
+    """Formato de número de Excel con la unidad como texto literal (el valor sigue siendo número)."""
+    numero = "0." + "0" * decimales if decimales else "0"
+    sufijo = sufijo.replace('"', "")
+    sufijo = f'" {sufijo}"' if sufijo else ""
+    if not signo:
+        return numero + sufijo
+    # Positivo;negativo;cero, como f"{v:+.4f}"
+    return f"+{numero}{sufijo};-{numero}{sufijo};+{numero}{sufijo}"
+
+
+FORMATO_PCT = formato_numero(4, "%")
+FORMATO_GB = formato_numero(2, "GB")
+
+
 def formato_pct(v):
+    """Celda numérica (valor, formato de Excel) que se ve como "12.3456 %"; N/A si falta."""
+    return (v, FORMATO_PCT) if v is not None else "N/A"
+
+
+def texto_pct(v):
     return f"{v:.4f} %" if v is not None else "N/A"
 
 
+def unidad(metrica):
+    """Unidad del item; las de utilización sin unidad en Zabbix se toman como %."""
+    units = metrica.get("units") or ""
+    if not units and "utilization" in metrica.get("nombre_reporte", "").lower():
+        return "%"
+    return units
+
+
+def formato_valor(v, units="%"):
+    """Porcentajes como formato_pct; el resto con la unidad del item (catálogo de métricas)."""
+    if units == "%" or v is None:
+        return formato_pct(v)
+    return (v, formato_numero(4, units))
+
+
+def formato_delta(v, units="%"):
+    """Diferencia entre ventanas con signo (en puntos porcentuales para %)."""
+    if v is None:
+        return "N/A"
+    return (v, formato_numero(4, "pp" if units == "%" else units, signo=True))
+
+
 def bytes_a_gb(v):
     if v is None:
         return "N/A"
-    return f"{v / (1024 ** 3):.2f} GB"
+    return (v / (1024 ** 3), FORMATO_GB)
 
 
-def extraer_umbrales(triggers):
-    umbrales = []
+def sumar_sketch(combinado, sketch):
+    if not sketch:
+        return
+    combinado["alpha"] = sketch.get("alpha", combinado["alpha"])
+    combinado["ceros"] += sketch.get("ceros", 0)
+    for indice, conteo in zip(sketch.get("indices", []), sketch.get("conteos", [])):
+        combinado["buckets"][indice] = combinado["buckets"].get(indice, 0) + conteo
 
-    for t in triggers:
-        desc = t.get("description", "")
-        expr = t.get("expression", "")
 
-        match = re.search(r"([><=]+)\s*(\d+(?:\.\d+)?|\{\$[^\}]+})", expr)
+def cuantil_sketch(combinado, q):
+    total = combinado["ceros"] + sum(combinado["buckets"].values())
+    if not total or combinado["alpha"] is None:
+        return None
 
-        if match:
-            umbrales.append(f"{desc} [{match.group(1)} {match.group(2)}]")
-        else:
-            umbrales.append(desc)
+    gamma = (1 + combinado["alpha"]) / (1 - combinado["alpha"])
+    rango = q * (total - 1)
+    acumulado = combinado["ceros"]
+    if acumulado > rango:
+        return 0.0
 
+    indices = sorted(combinado["buckets"])
+    for indice in indices:
+        acumulado += combinado["buckets"][indice]
+        if acumulado > rango:
+            break
+
+    return round(2 * math.pow(gamma, indice) / (gamma + 1), 4)
+
+
+def umbrales_metrica(metrica):
+    """
+    Umbrales estructurados de la métrica (ver umbrales_triggers en
+    extraer_zabbix.py). Los JSON anteriores solo traen "triggers": se leen
+    de las expresiones, sin macros resueltos ni tiempo en umbral.
+    """
+    if "umbrales" in metrica:
+        return metrica["umbrales"]
+
+    umbrales = []
+    for t in metrica.get("triggers", []):
+        match = PATRON_UMBRAL_ANTERIOR.search(t.get("expression", ""))
+        umbrales.append({
+            "trigger": t.get("description", ""),
+            "operador": match.group(1) if match else None,
+            "texto": match.group(2) if match else None,
+        })
     return umbrales
 
 
+def textos_umbrales(umbrales):
+    textos = []
+
+    for u in umbrales:
+        if not u.get("operador"):
+            textos.append(u.get("trigger", ""))
+            continue
+
+        texto = u["texto"]
+        v = u.get("valor")
+        if texto.startswith("{$") and v is not None:
+            texto = f"{texto} = {int(v) if v == int(v) else v}"
+        textos.append(f"{u.get('trigger', '')} [{u['operador']} {texto}]")
+
+    return textos
+
+
+def tiempo_en_umbral(umbrales):
+    """Mayor % del tiempo que la serie estuvo del lado de alguno de sus triggers."""
+    pcts = [u["pct_tiempo"] for u in umbrales if u.get("pct_tiempo") is not None]
+    return formato_pct(max(pcts) if pcts else None)
+
+
 def construir_fila_principal(maquina):
     fila = {
         "Nombre Activo": maquina.get("nombre_maquina", ""),
@@ -58,8 +347,14 @@ def construir_fila_principal(maquina):
         "CPU actual asignada": "N/A",
         "% uso procesador AVG": "N/A",
         "% uso procesador MAX": "N/A",
+        "% uso procesador P50": "N/A",
+        "% uso procesador P95": "N/A",
+        "% uso procesador P99": "N/A",
         "% uso memoria ram AVG": "N/A",
         "% uso memoria ram MAX": "N/A",
+        "% uso memoria ram P50": "N/A",
+        "% uso memoria ram P95": "N/A",
+        "% uso memoria ram P99": "N/A",
         "Item CPU usado": "",
         "Item RAM usado": "",
         "Key CPU": "",
@@ -92,17 +387,21 @@ def construir_fila_principal(maquina):
         elif nombre == "CPU utilization":
             fila["% uso procesador AVG"] = formato_pct(avg)
             fila["% uso procesador MAX"] = formato_pct(maximo)
+            for p in ("p50", "p95", "p99"):
+                fila[f"% uso procesador {p.upper()}"] = formato_pct(valor(datos, p))
             fila["Item CPU usado"] = item_name
             fila["Key CPU"] = key
 
         elif nombre == "Memory utilization":
             fila["% uso memoria ram AVG"] = formato_pct(avg)
             fila["% uso memoria ram MAX"] = formato_pct(maximo)
+            for p in ("p50", "p95", "p99"):
+                fila[f"% uso memoria ram {p.upper()}"] = formato_pct(valor(datos, p))
             fila["Item RAM usado"] = item_name
             fila["Key RAM"] = key
 
         if "utilization" in nombre.lower():
-            for u in extraer_umbrales(metrica.get("triggers", [])):
+            for u in textos_umbrales(umbrales_metrica(metrica)):
                 umbrales_total.append(f"{item_name}: {u}")
 
     if umbrales_total:
@@ -111,87 +410,292 @@ def construir_fila_principal(maquina):
     return fila
 
 
-def construir_summary(maquinas):
-    filas = []
+def construir_filas_summary(maquina):
+    """
+    Filas de Summary de una máquina, seguidas de una fila en blanco. Las
+    métricas estáticas del catálogo solo llenan "Ultimo valor".
+    """
+    grupo = maquina.get("grupo", "")
+    nombre_maquina = maquina.get("nombre_maquina", "")
+    ip = maquina.get("objetivo", "")
 
-    for maquina in maquinas:
-        grupo = maquina.get("grupo", "")
-        nombre_maquina = maquina.get("nombre_maquina", "")
-        ip = maquina.get("objetivo", "")
-
-        for metrica in maquina.get("metricas", []):
-            nombre = metrica.get("nombre_reporte", "")
+    for metrica in maquina.get("metricas", []):
+        nombre = metrica.get("nombre_reporte", "")
+        datos = metrica.get("datos", {})
+        units = unidad(metrica)
 
-            if "utilization" not in nombre.lower():
+        if not metrica.get("sketch") and "utilization" not in nombre.lower():
+            if nombre in ESTATICAS_PRINCIPAL:
                 continue
-
-            datos = metrica.get("datos", {})
-            avg = valor(datos, "avg")
-            maximo = valor(datos, "max")
-
-            umbrales = extraer_umbrales(metrica.get("triggers", []))
-            umbrales_txt = "\n".join(f"- {u}" for u in umbrales) if umbrales else "—"
-
-            filas.append({
+            yield {
                 "Grupo": grupo,
                 "Nombre maquina": nombre_maquina,
                 "IP": ip,
                 "Metrica": metrica.get("item_name", nombre),
                 "Key": metrica.get("key_", ""),
-                "Promedio": formato_pct(avg),
-                "Maximo": formato_pct(maximo),
-                "Umbrales detectados": umbrales_txt,
-            })
+                "Promedio": "",
+                "Maximo": "",
+                "P50": "",
+                "P95": "",
+                "P99": "",
+                "Ultimo valor": formato_valor(valor(datos, "ultimo"), units),
+                "Umbrales detectados": "—",
+                "% tiempo sobre umbral": "",
+            }
+            continue
 
-        filas.append({
-            "Grupo": "",
-            "Nombre maquina": "",
-            "IP": "",
-            "Metrica": "",
-            "Key": "",
-            "Promedio": "",
-            "Maximo": "",
-            "Umbrales detectados": "",
-        })
+        avg = valor(datos, "avg")
+        maximo = valor(datos, "max")
 
-    return filas
+        umbrales = umbrales_metrica(metrica)
+        textos = textos_umbrales(umbrales)
+        umbrales_txt = "\n".join(f"- {u}" for u in textos) if textos else "—"
+
+        yield {
+            "Grupo": grupo,
+            "Nombre maquina": nombre_maquina,
+            "IP": ip,
+            "Metrica": metrica.get("item_name", nombre),
+            "Key": metrica.get("key_", ""),
+            "Promedio": formato_valor(avg, units),
+            "Maximo": formato_valor(maximo, units),
+            "P50": formato_valor(valor(datos, "p50"), units),
+            "P95": formato_valor(valor(datos, "p95"), units),
+            "P99": formato_valor(valor(datos, "p99"), units),
+            "Ultimo valor": "",
+            "Umbrales detectados": umbrales_txt,
+            "% tiempo sobre umbral": tiempo_en_umbral(umbrales),
+        }
+
+    yield {
+        "Grupo": "",
+        "Nombre maquina": "",
+        "IP": "",
+        "Metrica": "",
+        "Key": "",
+        "Promedio": "",
+        "Maximo": "",
+        "P50": "",
+        "P95": "",
+        "P99": "",
+        "Ultimo valor": "",
+        "Umbrales detectados": "",
+        "% tiempo sobre umbral": "",
+    }
 
 
-def ajustar_excel(writer):
-    for hoja in writer.sheets:
-        ws = writer.sheets[hoja]
-        ws.freeze_panes = "A2"
+class PercentilesGrupo:
+    """
+    Percentiles por grupo combinando los sketches de cada host a medida que
+    pasan las máquinas: no hace falta volver a consultar las series ni
+    guardar las métricas.
+    """
 
-        for col in ws.columns:
-            letra = col[0].column_letter
-            ancho = 18
+    def __init__(self):
+        self.por_grupo = {}
 
-            for celda in col:
-                texto = str(celda.value) if celda.value is not None else ""
-                ancho = max(ancho, min(len(texto) + 2, 55))
+    def agregar(self, maquina):
+        for metrica in maquina.get("metricas", []):
+            if not metrica.get("sketch"):
+                continue
 
-            ws.column_dimensions[letra].width = ancho
+            clave = (maquina.get("grupo", ""), metrica.get("nombre_reporte", ""))
+            if clave not in self.por_grupo:
+                self.por_grupo[clave] = {
+                    "sketch": {"alpha": None, "ceros": 0, "buckets": {}},
+                    "units": unidad(metrica),
+                    "maquinas": 0,
+                    "max": None,
+                }
+            acumulado = self.por_grupo[clave]
+            sumar_sketch(acumulado["sketch"], metrica["sketch"])
+            acumulado["maquinas"] += 1
+
+            maximo = valor(metrica.get("datos", {}), "max")
+            if maximo is not None and (acumulado["max"] is None or maximo > acumulado["max"]):
+                acumulado["max"] = maximo
+
+    def filas(self):
+        for (grupo, nombre), acumulado in self.por_grupo.items():
+            combinado = acumulado["sketch"]
+            units = acumulado["units"]
+
+            yield {
+                "Grupo": grupo,
+                "Nombre maquina": f"(grupo: {acumulado['maquinas']} máquinas)",
+                "IP": "",
+                "Metrica": nombre,
+                "Key": "",
+                "Promedio": "",
+                "Maximo": formato_valor(acumulado["max"], units),
+                "P50": formato_valor(cuantil_sketch(combinado, 0.50), units),
+                "P95": formato_valor(cuantil_sketch(combinado, 0.95), units),
+                "P99": formato_valor(cuantil_sketch(combinado, 0.99), units),
+                "Umbrales detectados": "",
+            }
+
+
+def construir_grupos(grupos):
+    """
+    Una fila por grupo con la sección "grupos" que calcula extraer_zabbix.py
+    durante la extracción (ver AgregadoGrupos): no se recorren las máquinas.
+    """
+    filas = []
 
+    for grupo, datos in grupos.items():
+        top = [
+            f"{h.get('nombre_maquina') or h.get('objetivo', '')} ({texto_pct(valor(h, 'cpu_p95'))})"
+            for h in datos.get("top_hosts", [])
+        ]
+        filas.append({
+            "Grupo": grupo,
+            "Hosts": datos.get("hosts", 0),
+            "Núcleos": datos.get("nucleos", 0),
+            "Memoria total": bytes_a_gb(valor(datos, "memoria_bytes")),
+            "% CPU promedio (ponderado por núcleos)": formato_pct(valor(datos, "cpu_promedio_ponderado")),
+            "% RAM promedio (ponderado por memoria)": formato_pct(valor(datos, "ram_promedio_ponderado")),
+            "Hosts fuera del % CPU (sin núcleos)": datos.get("cpu_hosts_sin_peso", 0),
+            "Hosts fuera del % RAM (sin memoria)": datos.get("ram_hosts_sin_peso", 0),
+            "% CPU P95 de máximos": formato_pct(valor(datos, "cpu_p95_maximos")),
+            "% RAM P95 de máximos": formato_pct(valor(datos, "ram_p95_maximos")),
+            "Top hosts (CPU P95)": " | ".join(top) if top else "—",
+        })
 
-def generar_excel(payload, salida):
-    maquinas = payload.get("maquinas", [])
-    trafico = payload.get("trafico", {})
+    return filas
 
-    filas_principal = [construir_fila_principal(m) for m in maquinas]
-    filas_summary = construir_summary(maquinas)
 
-    resumen_general = [
+def construir_filas_rollups(maquina):
+    """
+    Una fila por métrica de utilización de la máquina con los rollups que
+    calcula extraer_zabbix.py: promedio laboral / no laboral, pico diario,
+    promedio por hora del día (H00..H23) y máximo por día.
+    """
+    for metrica in maquina.get("metricas", []):
+        rollups = metrica.get("rollups")
+        if not rollups:
+            continue
+
+        dia = rollups.get("dia", {})
+        maximos_dia = [
+            (m, f) for m, f in zip(dia.get("max", []), dia.get("fechas", [])) if m is not None
+        ]
+        pico, fecha_pico = max(maximos_dia, key=lambda x: x[0]) if maximos_dia else (None, "N/A")
+        units = unidad(metrica)
+
+        fila = {
+            "Grupo": maquina.get("grupo", ""),
+            "Nombre maquina": maquina.get("nombre_maquina", ""),
+            "IP": maquina.get("objetivo", ""),
+            "Metrica": metrica.get("item_name", metrica.get("nombre_reporte", "")),
+            "Promedio laboral": formato_valor(rollups.get("laboral", {}).get("avg"), units),
+            "Promedio no laboral": formato_valor(rollups.get("no_laboral", {}).get("avg"), units),
+            "Pico diario": formato_valor(pico, units),
+            "Fecha pico": fecha_pico,
+        }
+
+        for hora, v in enumerate(rollups.get("hora_dia", {}).get("avg", [])):
+            fila[f"H{hora:02d}"] = formato_valor(v, units)
+
+        for fecha, v in zip(dia.get("fechas", []), dia.get("max", [])):
+            fila[f"Máx {fecha}"] = formato_valor(v, units)
+
+        yield fila
+
+
+class ComparacionPeriodos:
+    """
+    Comparación de períodos (extraer_zabbix.py --comparar-periodos): una
+    fila por máquina y métrica con AVG / MAX / P95 de cada ventana lado a
+    lado, de la más antigua a la actual, y el delta contra la ventana
+    anterior. Por grupo se acumulan suma y cantidad de los AVG y el máximo
+    de los MAX, y filas_grupo() da al final una fila por grupo.
+    """
+
+    def __init__(self):
+        self.por_grupo = {}
+
+    def filas(self, maquina):
+        for metrica in maquina.get("metricas", []):
+            periodos = metrica.get("periodos")
+            if not periodos:
+                continue
+            units = unidad(metrica)
+            ventanas = self.por_grupo.setdefault(
+                (maquina.get("grupo", ""), metrica.get("nombre_reporte", ""), units), {}
+            )
+
+            fila = {
+                "Grupo": maquina.get("grupo", ""),
+                "Nombre maquina": maquina.get("nombre_maquina", ""),
+                "IP": maquina.get("objetivo", ""),
+                "Metrica": metrica.get("item_name", metrica.get("nombre_reporte", "")),
+            }
+
+            for k, periodo in enumerate(periodos):
+                etiqueta = f"{periodo.get('inicio', '')[:10]} a {periodo.get('fin', '')[:10]}"
+                datos = periodo.get("datos", {})
+                for campo in ("avg", "max", "p95"):
+                    fila[f"{campo.upper()} {etiqueta}"] = formato_valor(valor(datos, campo), units)
+                if k:
+                    delta = periodo.get("delta") or {}
+                    for campo in ("avg", "max", "p95"):
+                        fila[f"Δ {campo.upper()} {etiqueta}"] = formato_delta(valor(delta, campo), units)
+
+                acumulado = ventanas.setdefault(etiqueta, {"maquinas": 0, "suma_avg": 0, "con_avg": 0, "max": None})
+                acumulado["maquinas"] += 1
+                avg = valor(datos, "avg")
+                if avg is not None:
+                    acumulado["suma_avg"] += avg
+                    acumulado["con_avg"] += 1
+                maximo = valor(datos, "max")
+                if maximo is not None and (acumulado["max"] is None or maximo > acumulado["max"]):
+                    acumulado["max"] = maximo
+
+            yield fila
+
+    def filas_grupo(self):
+        if not self.por_grupo:
+            return
+
+        yield {}
+        for (grupo, nombre, units), ventanas in self.por_grupo.items():
+            fila = {
+                "Grupo": grupo,
+                "Nombre maquina": f"(grupo: {max(v['maquinas'] for v in ventanas.values())} máquinas)",
+                "IP": "",
+                "Metrica": nombre,
+            }
+            anterior = None
+            for etiqueta, acumulado in ventanas.items():
+                avg = acumulado["suma_avg"] / acumulado["con_avg"] if acumulado["con_avg"] else None
+                maximo = acumulado["max"]
+
+                fila[f"AVG {etiqueta}"] = formato_valor(avg, units)
+                fila[f"MAX {etiqueta}"] = formato_valor(maximo, units)
+                if anterior is not None:
+                    fila[f"Δ AVG {etiqueta}"] = formato_delta(
+                        avg - anterior[0] if avg is not None and anterior[0] is not None else None, units
+                    )
+                    fila[f"Δ MAX {etiqueta}"] = formato_delta(
+                        maximo - anterior[1] if maximo is not None and anterior[1] is not None else None, units
+                    )
+                anterior = (avg, maximo)
+            yield fila
+
+
+def construir_resumen_general(maquinas, trafico):
+    return [
         {
             "Indicador": "Máquinas procesadas",
-            "Valor": len(maquinas),
+            "Valor": maquinas,
         },
         {
             "Indicador": "Tráfico subida (MB)",
-            "Valor": f"{trafico.get('subida_bytes', 0) / (1024 ** 2):.2f}",
+            "Valor": (trafico.get("subida_bytes", 0) / (1024 ** 2), formato_numero(2)),
         },
         {
             "Indicador": "Tráfico bajada (MB)",
-            "Valor": f"{trafico.get('bajada_bytes', 0) / (1024 ** 2):.2f}",
+            "Valor": (trafico.get("bajada_bytes", 0) / (1024 ** 2), formato_numero(2)),
         },
         {
             "Indicador": "Generado",
@@ -199,38 +703,241 @@ def generar_excel(payload, salida):
         },
     ]
 
-    with pd.ExcelWriter(salida, engine="openpyxl") as writer:
-        pd.DataFrame(filas_principal).to_excel(
-            writer,
-            index=False,
-            sheet_name="Metricas_Infraestructura",
-        )
 
-        pd.DataFrame(filas_summary).to_excel(
-            writer,
-            index=False,
-            sheet_name="Summary",
-        )
+def construir_rendimiento(rendimiento):
+    """Una fila por método de la API, una por fase y el tope de concurrencia."""
+    filas = []
 
-        pd.DataFrame(resumen_general).to_excel(
-            writer,
-            index=False,
-            sheet_name="Resumen_General",
+    for metodo, datos in rendimiento.get("metodos", {}).items():
+        latencia = datos.get("latencia_ms", {})
+        filas.append({
+            "Tipo": "Método API",
+            "Nombre": metodo,
+            "Llamadas": datos.get("llamadas", 0),
+            "Errores": datos.get("errores", 0),
+            "Reintentos": datos.get("reintentos", 0),
+            "Particiones": datos.get("particiones", 0),
+            "Latencia p50 (ms)": latencia.get("p50"),
+            "Latencia p95 (ms)": latencia.get("p95"),
+            "Latencia máx (ms)": latencia.get("max"),
+            "Subida (KB)": (datos.get("subida_bytes", 0) / 1024, formato_numero(1)),
+            "Bajada (KB)": (datos.get("bajada_bytes", 0) / 1024, formato_numero(1)),
+            "Segundos": "",
+        })
+
+    for fase, segundos in rendimiento.get("fases_segundos", {}).items():
+        filas.append({
+            "Tipo": "Fase",
+            "Nombre": fase,
+            "Segundos": (segundos, formato_numero(2)),
+        })
+
+    concurrencia = rendimiento.get("concurrencia")
+    if concurrencia:
+        filas.append({
+            "Tipo": "Concurrencia",
+            "Nombre": (
+                f"tope {concurrencia.get('maximo')} -> final {concurrencia.get('final')} "
+                f"(mínimo {concurrencia.get('minimo')}, {concurrencia.get('reducciones')} reducciones)"
+            ),
+        })
+
+    return filas
+
+
+@functools.lru_cache(maxsize=None)
+def medida_formato(formato):
+    """(decimales, caracteres fijos) de un formato de formato_numero, para estimar el ancho."""
+    seccion = formato.split(";")[0]
+    decimales = len(re.search(r"0(?:\.(0*))?", seccion).group(1) or "")
+    sufijo = re.search(r'"([^"]*)"', seccion)
+    return decimales, (len(sufijo.group(1)) if sufijo else 0) + seccion.startswith("+")
+
+
+class HojaExcel:
+    """
+    Hoja escrita fila a fila: con el libro en modo constant_memory cada
+    fila se vuelca al disco al pasar a la siguiente (cada hoja tiene su
+    propio archivo temporal, así que se pueden intercalar filas de varias
+    hojas). El encabezado son las claves de la primera fila y el ancho de
+    cada columna se calcula mientras se escribe, sin volver a recorrer la
+    hoja. Una celda (valor, formato) se escribe como número con ese
+    formato de Excel (ver formato_numero).
+
+    Con crear=False la hoja se agrega al libro recién con su primera fila:
+    si no llega ninguna, no aparece.
+    """
+
+    def __init__(self, libro, nombre, encabezado=None, formatos=None, crear=True):
+        self.libro = libro
+        self.nombre = nombre
+        self.encabezado = encabezado
+        self.formatos = formatos
+        self.ws = None
+        self.columnas = None
+        self.omitidas = set()
+        self.fila = 0
+        if crear:
+            self._crear()
+
+    def _crear(self):
+        self.ws = self.libro.add_worksheet(self.nombre)
+        self.ws.freeze_panes(1, 0)
+
+    def agregar(self, fila):
+        if self.columnas is None:
+            if self.ws is None:
+                self._crear()
+            self.columnas = {c: i for i, c in enumerate(fila)}
+            self.anchos = [ANCHO_MIN] * len(self.columnas)
+            self._escribir(list(self.columnas), self.encabezado)
+
+        valores = [None] * len(self.columnas)
+        for clave, v in fila.items():
+            if clave in self.columnas:
+                valores[self.columnas[clave]] = v
+            elif clave not in self.omitidas:
+                # El encabezado ya está en disco: una columna nueva no entra
+                self.omitidas.add(clave)
+                print(f"[!] Hoja {self.nombre}: columna '{clave}' fuera del encabezado, se omite", file=sys.stderr)
+        self._escribir(valores)
+
+    def _escribir(self, valores, formato=None):
+        for col, v in enumerate(valores):
+            if v is None or v == "":
+                continue
+
+            largo = None
+            if isinstance(v, tuple):
+                numero, num_formato = v
+                if numero is not None and math.isfinite(numero):
+                    self.ws.write_number(self.fila, col, numero, self.formatos(num_formato))
+                    decimales, fijos = medida_formato(num_formato)
+                    largo = len(f"{numero:.{decimales}f}") + fijos
+                else:
+                    v = "N/A"
+            elif isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v):
+                self.ws.write_number(self.fila, col, v, formato)
+                largo = len(str(v))
+
+            if largo is None:
+                # write_string: un texto que empieza con "=" o es una URL queda como texto
+                v = str(v)
+                self.ws.write_string(self.fila, col, v, formato)
+                largo = len(v)
+
+            self.anchos[col] = max(self.anchos[col], min(largo + 2, ANCHO_MAX))
+
+        self.fila += 1
+
+    def cerrar(self):
+        if self.ws is None:
+            return
+        if self.columnas is None:
+            # Creada de antemano para fijar el orden de las hojas, pero sin filas
+            self.ws.hide()
+            return
+
+        # En xlsxwriter las columnas se escriben al cerrar el libro
+        for col, ancho in enumerate(self.anchos):
+            self.ws.set_column(col, col, ancho)
+
+
+class LibroExcel:
+    """Libro xlsxwriter en modo constant_memory: la memoria no crece con las filas."""
+
+    def __init__(self, ruta):
+        self.libro = xlsxwriter.Workbook(ruta, {"constant_memory": True})
+        self.encabezado = self.libro.add_format(ESTILO_ENCABEZADO)
+        self._formatos = {}
+        self.hojas = []
+
+    def formato(self, num_formato):
+        """Un solo Format de xlsxwriter por formato de número."""
+        if num_formato not in self._formatos:
+            self._formatos[num_formato] = self.libro.add_format({"num_format": num_formato})
+        return self._formatos[num_formato]
+
+    def hoja(self, nombre, crear=True):
+        """Hoja nueva (HojaExcel) para ir agregando filas; las hojas quedan en el orden en que se crean."""
+        hoja = HojaExcel(self.libro, nombre, self.encabezado, self.formato, crear)
+        self.hojas.append(hoja)
+        return hoja
+
+    def escribir(self, nombre, filas):
+        """
+        Escribe filas (iterable de dicts, puede ser un generador) en una hoja
+        nueva; sin filas la hoja no se crea.
+        """
+        hoja = self.hoja(nombre, crear=False)
+        for fila in filas:
+            hoja.agregar(fila)
+
+    def cerrar(self):
+        for hoja in self.hojas:
+            hoja.cerrar()
+        self.libro.close()
+
+
+def generar_excel(payload, salida):
+    """
+    Una sola pasada por las máquinas, que pueden venir de un iterador de
+    leer_payload: cada una agrega sus filas a todas las hojas y los
+    agregados por grupo se escriben al final. "grupos" y "trafico" están
+    antes que "maquinas" en la salida del extractor; "rendimiento" se usa
+    recién después de recorrerlas.
+    """
+    libro = LibroExcel(salida)
+    try:
+        principal = libro.hoja("Metricas_Infraestructura")
+        summary = libro.hoja("Summary")
+        libro.escribir("Grupos", construir_grupos(payload.get("grupos", {})))
+        rollups = libro.hoja("Rollups")
+        # Sin --comparar-periodos la hoja no existía: se crea solo si llegan filas
+        comparacion_hoja = libro.hoja(
+            "Comparacion_Periodos", crear=bool(payload.get("rango", {}).get("comparar_periodos"))
         )
 
-        ajustar_excel(writer)
+        percentiles = PercentilesGrupo()
+        comparacion = ComparacionPeriodos()
+        total = 0
+
+        for maquina in payload.get("maquinas", []):
+            total += 1
+            principal.agregar(construir_fila_principal(maquina))
+            for fila in construir_filas_summary(maquina):
+                summary.agregar(fila)
+            percentiles.agregar(maquina)
+            for fila in construir_filas_rollups(maquina):
+                rollups.agregar(fila)
+            for fila in comparacion.filas(maquina):
+                comparacion_hoja.agregar(fila)
+
+        for fila in percentiles.filas():
+            summary.agregar(fila)
+        for fila in comparacion.filas_grupo():
+            comparacion_hoja.agregar(fila)
+
+        libro.escribir("Rendimiento", construir_rendimiento(payload.get("rendimiento", {})))
+        libro.escribir("Resumen_General", construir_resumen_general(total, payload.get("trafico", {})))
+    finally:
+        libro.cerrar()
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", required=True, help="Archivo .json o .json.gz generado por extraer_zabbix.py")
+    parser.add_argument("--input", required=True, help="Archivo .json, .json.gz o .ndjson generado por extraer_zabbix.py")
     parser.add_argument("--output", required=True, help="Archivo Excel de salida")
     args = parser.parse_args()
 
     payload = cargar_json(args.input)
 
-    if not payload.get("maquinas"):
+    # "maquinas" puede ser un iterador: se mira la primera y se vuelve a encadenar
+    maquinas = iter(payload.get("maquinas") or [])
+    primera = next(maquinas, None)
+    if primera is None:
         raise SystemExit("[!] No hay máquinas en el JSON de entrada.")
+    payload["maquinas"] = itertools.chain([primera], maquinas)
 
     generar_excel(payload, args.output)
 